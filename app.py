@@ -1,21 +1,21 @@
 import streamlit as st
+import calendar
 import datetime
 import pandas as pd
 import os
 import random
-import matplotlib.pyplot as plt
-import seaborn as sns
-import io
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-import base64
 import os
 import pytz
 import datetime
 import pytz  # Make sure this is in requirements.txt
+import charts
+import core
+import importer
+import reports
+import timing
+import storage as storage_module
+from storage import open_user_storage
+from store import frame_span, from_cents, month_key, month_range, split_month_key, year_range
 
 # Set your desired timezone (e.g., 'Asia/Kolkata' for India)
 tz = pytz.timezone('Asia/Kolkata')  # Change this based on your location
@@ -30,10 +30,18 @@ os.environ['TZ'] = 'Asia/Kolkata'  # Change to your timezone
 
 class ExpenseTracker:
     def __init__(self):
-        self.filepath = "expenses.csv"
-        self.budget_file = "budget.csv"
+        # Signed-in users each get their own storage shard; without
+        # authentication everyone shares the top-level files
+        self.user = self.session_user()
+
+        # Optional Prometheus / JSON endpoint for the timings
+        if os.environ.get("EXPENSE_METRICS_PORT"):
+            timing.serve(int(os.environ["EXPENSE_METRICS_PORT"]))
+        self.storage = open_user_storage(self.user)
         self.expenses = self.load_expenses()
         self.budget = self.load_budget()
+        # Category registry shared by every screen; codes match the store's
+        self.categories = self.storage.load_categories()
 
         # Initialize session state for editing and refreshing
         if 'edit_expense' not in st.session_state:
@@ -43,55 +51,87 @@ class ExpenseTracker:
 
         self.run()
 
-    def load_expenses(self):
-        if os.path.exists(self.filepath):
-            return pd.read_csv(self.filepath).values.tolist()
-        return []
+    @staticmethod
+    def session_user():
+        """Return the signed-in user's email, or None if nobody is signed in."""
+        return st.user.get("email") or None
 
-    def save_expenses(self):
-        df = pd.DataFrame(self.expenses, columns=["Date", "Category", "Amount"])
-        df.to_csv(self.filepath, index=False)
+    def load_expenses(self):
+        # Columnar ExpenseStore; every screen reads the shared frame() from it.
+        # Cached across reruns until the files change on disk.
+        with timing.timed("storage.load_expenses"):
+            return self.storage.load_expenses()
 
     def load_budget(self):
-        if os.path.exists(self.budget_file):
-            return pd.read_csv(self.budget_file, index_col=0).to_dict()["Budget"]
-        return {}
+        with timing.timed("storage.load_budget"):
+            return self.storage.load_budget()
 
     def save_budget(self):
-        df = pd.DataFrame.from_dict(self.budget, orient='index', columns=["Budget"])
-        df.to_csv(self.budget_file)
+        with timing.timed("storage.save_budget"):
+            self.storage.save_budget(self.budget)
 
     def run(self):
         st.title("Smart Expense Tracker")
 
-        menu = ["Add Expense", "View Expenses", "Set Budget", "Budget Summary", "Daily Expense", "Report"]
+        menu = ["Add Expense", "Import", "View Expenses", "Set Budget", "Budget Summary", "Daily Expense", "Report"]
         choice = st.sidebar.selectbox("Menu", menu)
 
-        if choice == "Add Expense":
-            self.add_expense_ui()
-        elif choice == "View Expenses":
-            self.view_expenses()
-        elif choice == "Set Budget":
-            self.set_budget_ui()
-        elif choice == "Budget Summary":
-            self.budget_summary()
-        elif choice == "Daily Expense":
-            self.daily_expense()
-        elif choice == "Report":
-            self.generate_report()
+        # Each screen is timed; runs that a screen ends early with st.rerun()
+        # are recorded too, as timing.timed records in a finally block
+        with timing.timed(f"screen.{choice}"):
+            if choice == "Add Expense":
+                self.add_expense_ui()
+            elif choice == "Import":
+                self.import_expenses_ui()
+            elif choice == "View Expenses":
+                self.view_expenses()
+            elif choice == "Set Budget":
+                self.set_budget_ui()
+            elif choice == "Budget Summary":
+                self.budget_summary()
+            elif choice == "Daily Expense":
+                self.daily_expense()
+            elif choice == "Report":
+                self.generate_report()
+
+        if os.environ.get("EXPENSE_DEBUG") or st.query_params.get("debug") == "1":
+            self.debug_panel()
 
         # Handle the refresh request
         if st.session_state.refresh:
             st.session_state.refresh = False
             st.rerun()
 
+    def debug_panel(self):
+        """Sidebar panel with the process-wide timings and cache statistics."""
+        with st.sidebar.expander("Performance", expanded=True):
+            stats = timing.snapshot()
+            if stats:
+                df = pd.DataFrame.from_dict(stats, orient="index")
+                for column in ["total", "mean", "p50", "p95", "max"]:
+                    df[column] = df[column] * 1000
+                st.dataframe(df.rename(columns=lambda c: c if c == "count" else f"{c} (ms)").round(2))
+            st.caption(f"Data cache: {storage_module.cache_stats()}")
+            st.caption(f"Chart cache: {charts.cache_stats()}")
+            st.caption(f"File locks: {storage_module.lock_stats()}")
+            st.download_button("Timings (JSON)", timing.to_json(), "timings.json", "application/json")
+            st.download_button("Timings (Prometheus)", timing.to_prometheus(), "timings.prom", "text/plain")
+
     def add_expense_ui(self):
         st.subheader("Add a New Expense")
         today = datetime.date.today()
         date = st.date_input("Date", today, max_value=today)
 
-        categories = ["Food", "Transport", "Entertainment", "Shopping", "Bills"]
-        category = st.selectbox("Category", categories)
+        category = st.selectbox("Category", self.categories.names())
+
+        with st.expander("Add a category"):
+            new_category = st.text_input("Category name", key="new_category")
+            if st.button("Add Category"):
+                try:
+                    name = self.storage.add_category(new_category)
+                    st.success(f"✅ Category {name} is available")
+                except ValueError as e:
+                    st.error(f"🚨 Error: {e}")
 
         amount = st.text_input("Amount", "")
 
@@ -104,10 +144,35 @@ class ExpenseTracker:
                 self.add_expense(date, category, amount)
 
     def add_expense(self, date, category, amount):
-        self.expenses.append([date.strftime('%Y-%m-%d'), category, amount])
-        self.save_expenses()
+        with timing.timed("storage.add_expense"):
+            self.storage.add_expense(date, category, amount)
         st.success(f"Expense Added: {date} | {category} | ${amount}")
 
+    def import_expenses_ui(self):
+        st.subheader("Import Expenses")
+        st.write(
+            "Upload a CSV export or bank statement with a date column, an amount "
+            "(or debit) column and optionally a category column. Expenses that "
+            "are already recorded are skipped."
+        )
+        uploaded = st.file_uploader("CSV file", type=["csv"])
+        dayfirst = st.checkbox("Dates are day first (DD/MM/YYYY)")
+
+        if uploaded is not None and st.button("Import"):
+            try:
+                result = importer.import_expenses(self.storage, uploaded, dayfirst=dayfirst)
+            except (ValueError, pd.errors.ParserError) as e:
+                st.error(f"Could not import {uploaded.name}: {e}")
+                return
+
+            st.success(f"Imported {result['imported']} of {result['rows']} rows from {uploaded.name}.")
+            if result["duplicates"]:
+                st.info(f"Skipped {result['duplicates']} expenses that were already recorded.")
+            if result["credits"]:
+                st.info(f"Skipped {result['credits']} credits (positive amounts in a signed statement).")
+            if result["invalid"]:
+                st.warning(f"Skipped {result['invalid']} rows with a missing or invalid date or amount.")
+
     def set_budget_ui(self):
         st.subheader("Set Monthly Budget")
 
@@ -116,8 +181,7 @@ class ExpenseTracker:
 
         selected_month = st.selectbox("Select Month", available_months)
 
-        categories = ["Food", "Transport", "Entertainment", "Shopping", "Bills"]
-        selected_category = st.selectbox("Select Category", categories)
+        selected_category = st.selectbox("Select Category", self.categories.names())
 
         category_budget = st.text_input(f"Set Budget for {selected_category}", value="")
 
@@ -128,7 +192,7 @@ class ExpenseTracker:
                     st.error("🚨 Error: Budget amount must be greater than zero.")
                     return
 
-                self.budget[f"{selected_month}-{selected_category}"] = budget_amount
+                self.budget.set(selected_month, selected_category, budget_amount)
                 self.save_budget()
                 st.success(f"✅ Budget for {selected_category} in {selected_month} set to ${budget_amount:.2f}")
             except ValueError:
@@ -137,16 +201,15 @@ class ExpenseTracker:
         st.subheader(f"Budget Overview for {selected_month}")
         selected_view_month = st.selectbox("Select Month to View Budget", available_months, key="view_budget_month")
 
-        # Fix: Ensure budget data is displayed
-        filtered_budget = {k: v for k, v in self.budget.items() if k.startswith(selected_view_month)}
+        # {category: budget} for the month, straight from the budget index
+        filtered_budget = self.budget.for_month(selected_view_month)
 
         if not filtered_budget:
             st.info("ℹ️ No budgets set for this month.")
             return
 
         budget_data = []
-        for key, value in filtered_budget.items():
-            category = key.split('-')[-1]  # Fix to get the last part as category
+        for category, value in filtered_budget.items():
             spent = self.calculate_expense_for_category(selected_view_month, category)
             remaining = value - spent
             status = "✔️ Within Budget" if spent <= value else "❌ Over Budget"
@@ -160,12 +223,9 @@ class ExpenseTracker:
                 st.warning(f"⚠️ Warning: Your {row[0]} budget of ${row[1]} has been exceeded! You've spent ${row[2]}.")
 
     def calculate_expense_for_category(self, month, category):
-        df = pd.DataFrame(self.expenses, columns=["Date", "Category", "Amount"])
-        df["Date"] = pd.to_datetime(df["Date"])
-        df["Month"] = df["Date"].dt.strftime('%Y-%m')
-
-        filtered_df = df[(df["Month"] == month) & (df["Category"] == category)]
-        return filtered_df["Amount"].sum() if not filtered_df.empty else 0.0
+        # O(1) lookup in the store's month x category aggregate
+        year, month_num = month.split('-')
+        return from_cents(self.expenses.month_category_total(month_key(year, month_num), category))
 
     # def view_expenses(self):
     #     st.subheader("View Expenses")
@@ -267,68 +327,83 @@ class ExpenseTracker:
     #         st.info("No expenses found for the selected filters.")
     def view_expenses(self):
         st.subheader("View Expenses")
-        if not self.expenses:
+        if not len(self.expenses):
             st.write("No expenses recorded yet.")
             return
 
-        # Create DataFrame
-        df = pd.DataFrame(self.expenses, columns=["Date", "Category", "Amount"])
-        df["Date"] = pd.to_datetime(df["Date"])
-        df["Year"] = df["Date"].dt.year
-        df["Month"] = df["Date"].dt.strftime('%B')
-        df["Original_Index"] = df.index  # Track original index
+        # Shared expense frame, in date order: a selected year or month is a
+        # slice of it (frame_span); other filters are boolean masks.
+        # Years and months come from the integer MonthKey column.
+        df = self.expenses.frame()
+        years_col, months_col = split_month_key(df["MonthKey"])
 
         # Year filter
-        years = sorted(df["Year"].unique(), reverse=True)
+        years = sorted(years_col.unique(), reverse=True)
         selected_year = st.selectbox("Select Year", ["All"] + years)
 
         if selected_year != "All":
-            df = df[df["Year"] == selected_year]
+            first, stop = frame_span(df, *year_range(selected_year))
+            df, months_col = df.iloc[first:stop], months_col.iloc[first:stop]
             current_month = datetime.datetime.now().month
-            available_months = [datetime.date(2000, m, 1).strftime('%B') for m in range(1, current_month + 1)]
+            available_months = list(range(1, current_month + 1))
         else:
-            available_months = sorted(df["Month"].unique())
+            available_months = sorted(months_col.unique())
 
-        # Month filter
-        selected_month = st.selectbox("Select Month", ["All"] + available_months)
+        # Month filter (month numbers, shown by name)
+        selected_month = st.selectbox(
+            "Select Month", ["All"] + available_months,
+            format_func=lambda m: m if m == "All" else calendar.month_name[m]
+        )
 
         # Category filter
         categories = sorted(df["Category"].unique())
         selected_category = st.selectbox("Select Category", ["All"] + categories)
 
-        # Preserve the original DataFrame for calculations
-        month_df = df[df["Month"] == selected_month] if selected_month != "All" else df
-        total_month_expense = month_df["Amount"].sum()  # ✅ Total for selected month (ignoring category filter)
+        # Metrics come from the store's running totals; only the expense list
+        # below is filtered row by row
+        year = None if selected_year == "All" else int(selected_year)
+        month = None if selected_month == "All" else int(selected_month)
+        category = None if selected_category == "All" else selected_category
+        total_till_date = from_cents(self.expenses.total(year))
+        total_month_expense = from_cents(self.expenses.total(year, month))  # ✅ Total for selected month (ignoring category filter)
+        total_category_expense = from_cents(self.expenses.total(year, month, category)) if category else 0
 
         # Apply both filters to get the filtered expenses
-        filtered_df = month_df.copy()
+        if selected_month == "All":
+            filtered_df = df
+        elif selected_year != "All":
+            first, stop = frame_span(df, *month_range(selected_year, selected_month))
+            filtered_df = df.iloc[first:stop]
+        else:
+            filtered_df = df[months_col == selected_month]
         if selected_category != "All":
             filtered_df = filtered_df[filtered_df["Category"] == selected_category]
 
-        # Calculate total category-wise expenses within the selected month
-        if selected_category != "All" and selected_month != "All":
-            total_category_expense = df[(df["Category"] == selected_category) & (df["Month"] == selected_month)]["Amount"].sum()
-        else:
-            total_category_expense = df[df["Category"] == selected_category]["Amount"].sum() if selected_category != "All" else 0
-
-        # Total expenses across all time
-        total_till_date = df["Amount"].sum()
-
         # Display Metrics
         col1, col2, col3 = st.columns(3)
         with col1:
             st.metric("Total Till Date", f"${total_till_date:.2f}")
         with col2:
             if selected_month != "All":
-                st.metric(f"Total {selected_month} Expenses", f"${total_month_expense:.2f}")  # ✅ Month total ignores category
+                st.metric(f"Total {calendar.month_name[selected_month]} Expenses", f"${total_month_expense:.2f}")  # ✅ Month total ignores category
             else:
-                st.metric("Total All-Time Expenses", f"${df['Amount'].sum():.2f}")
+                st.metric("Total All-Time Expenses", f"${total_till_date:.2f}")
         with col3:
             if selected_category != "All":
                 st.metric(f"Total {selected_category} Expenses", f"${total_category_expense:.2f}")  # ✅ Category total within month
             else:
-                filtered_sum = filtered_df["Amount"].sum() if not filtered_df.empty else 0
-                st.metric("Total for Current Filter", f"${filtered_sum:.2f}")
+                st.metric("Total for Current Filter", f"${total_month_expense:.2f}")
+
+        # A compaction renumbers the rows (see ExpenseStore.id_version): an
+        # edit opened, or a button drawn, before it would act on another
+        # expense, so drop the edit and go back to the first page
+        id_version = self.expenses.id_version
+        if st.session_state.get("expense_id_version") != id_version:
+            if st.session_state.edit_expense is not None:
+                st.warning("The expense list was renumbered while editing. Please open the expense again.")
+                st.session_state.edit_expense = None
+            st.session_state.expense_page = 1
+            st.session_state.expense_id_version = id_version
 
         # Display Expenses
         if not filtered_df.empty:
@@ -338,8 +413,24 @@ class ExpenseTracker:
             if st.session_state.edit_expense is not None:
                 self.edit_expense_ui(st.session_state.edit_expense)
 
-            # Display each expense
-            for i, row in filtered_df.iterrows():
+            # Pagination: only one page of rows gets widgets, so the page
+            # costs the same however long the history is
+            page_sizes = [10, 25, 50, 100]
+            col1, col2 = st.columns(2)
+            with col1:
+                page_size = st.selectbox("Rows per page", page_sizes, index=1, key="expense_page_size")
+            page_count = (len(filtered_df) + page_size - 1) // page_size
+            if st.session_state.get("expense_page", 1) > page_count:
+                st.session_state.expense_page = 1
+            with col2:
+                page = st.number_input("Page", min_value=1, max_value=page_count, step=1, key="expense_page")
+
+            start = (page - 1) * page_size
+            page_df = filtered_df.iloc[start:start + page_size]
+            st.caption(f"Showing {start + 1}-{start + len(page_df)} of {len(filtered_df)} expenses")
+
+            # Display each expense on the current page
+            for i, row in page_df.iterrows():
                 col1, col2, col3, col4, col5 = st.columns([2, 2, 1, 1, 1])
                 with col1:
                     st.write(f"**Date:** {row['Date'].strftime('%Y-%m-%d')}")
@@ -348,13 +439,13 @@ class ExpenseTracker:
                 with col3:
                     st.write(f"**${row['Amount']:.2f}**")
                 with col4:
-                    if st.button("Edit", key=f"edit_{row['Original_Index']}"):
-                        st.session_state.edit_expense = int(row['Original_Index'])
+                    if st.button("Edit", key=f"edit_{id_version}_{row['Id']}"):
+                        st.session_state.edit_expense = int(row['Id'])
                         st.session_state.refresh = True
                         st.rerun()
                 with col5:
-                    if st.button("Delete", key=f"delete_{row['Original_Index']}"):
-                        self.delete_expense(int(row['Original_Index']))
+                    if st.button("Delete", key=f"delete_{id_version}_{row['Id']}"):
+                        self.delete_expense(int(row['Id']))
                         st.session_state.refresh = True
                         st.rerun()
                 st.divider()
@@ -362,29 +453,25 @@ class ExpenseTracker:
             st.info("No expenses found for the selected filters.")
 
 
-    def edit_expense_ui(self, index):
+    def edit_expense_ui(self, row_id):
         st.write("### Edit Expense")
 
         # Get the expense to edit
-        if index >= len(self.expenses):
+        expense = self.expenses.get(row_id)
+        if expense is None:
             st.error("Expense not found. It may have been deleted.")
             st.session_state.edit_expense = None
             return
 
-        expense = self.expenses[index]
-        date_str, category, amount = expense
-
-        # Convert date string to datetime
-        date = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
+        date, category, cents = expense
 
         # Create form for editing
-        with st.form(key=f"edit_form_{index}"):
+        with st.form(key=f"edit_form_{self.expenses.id_version}_{row_id}"):
             new_date = st.date_input("Date", date, max_value=datetime.date.today())
 
-            categories = ["Food", "Transport", "Entertainment", "Shopping", "Bills"]
-            new_category = st.selectbox("Category", categories, index=categories.index(category) if category in categories else 0)
+            new_category = st.selectbox("Category", self.categories.names(), index=self.categories.code(category))
 
-            new_amount = st.number_input("Amount", value=float(amount), min_value=0.01, format="%.2f")
+            new_amount = st.number_input("Amount", value=from_cents(cents), min_value=0.01, format="%.2f")
 
             col1, col2 = st.columns(2)
             with col1:
@@ -394,8 +481,8 @@ class ExpenseTracker:
 
         if update_button:
             # Update the expense
-            self.expenses[index] = [new_date.strftime('%Y-%m-%d'), new_category, new_amount]
-            self.save_expenses()
+            with timing.timed("storage.update_expense"):
+                self.storage.update_expense(row_id, new_date, new_category, new_amount)
             st.success("✅ Expense updated successfully!")
 
             # Clear the edit state and refresh
@@ -409,14 +496,10 @@ class ExpenseTracker:
             st.session_state.refresh = True
             st.rerun()
 
-    def delete_expense(self, index):
-        # Delete the expense at the given index
-        if 0 <= index < len(self.expenses):
-            expense = self.expenses[index]
-            self.expenses.pop(index)
-            self.save_expenses()
-            return True
-        return False
+    def delete_expense(self, row_id):
+        # Delete the expense with the given storage row id
+        with timing.timed("storage.delete_expense"):
+            return self.storage.delete_expense(row_id)
 
     def budget_summary(self):
         st.subheader("Budget Summary")
@@ -451,40 +534,26 @@ class ExpenseTracker:
         # Get current month for default view
         current_month = datetime.datetime.now().strftime('%Y-%m')
 
-        # Get all months with budget data
-        all_budget_months = set()
-        for key in self.budget.keys():
-            month_parts = key.split('-')
-            if len(month_parts) >= 2:  # Make sure there are at least 2 parts
-                month = month_parts[0] + '-' + month_parts[1]
-                all_budget_months.add(month)
+        # Get all months with budget data (sorted)
+        all_budget_months = self.budget.months()
 
         if not all_budget_months:
             st.info("No budget data available. Please set a budget first.")
             return
 
-        # Convert to list and sort
-        all_budget_months = sorted(list(all_budget_months))
-
         # Let user select month to view
         selected_month = st.selectbox("Select Month", all_budget_months, index=all_budget_months.index(current_month) if current_month in all_budget_months else 0)
 
-        # Filter budget data for selected month
-        filtered_budget = {k: v for k, v in self.budget.items() if k.startswith(selected_month)}
-
-        if not filtered_budget:
+        # Category budgets for the selected month, plus any whole-month budget
+        # left over from the older budget format, against the month's spending
+        status_data = core.budget_status(self.expenses, self.budget, selected_month)
+        if status_data is None:
             st.info(f"No budgets set for {selected_month}.")
             return
 
-        # Get expense data
-        df = pd.DataFrame(self.expenses, columns=["Date", "Category", "Amount"])
-        df["Date"] = pd.to_datetime(df["Date"])
-        df["Month"] = df["Date"].dt.strftime('%Y-%m')
-        month_df = df[df["Month"] == selected_month]
-
-        # Calculate total budget and spending
-        total_budget = sum(filtered_budget.values())
-        total_spent = month_df["Amount"].sum() if not month_df.empty else 0
+        month_limit = status_data["month_limit"]
+        total_budget = status_data["total_budget"]
+        total_spent = status_data["total_spent"]
 
         # Display overview
         st.markdown(f"## Monthly Overview for {selected_month}")
@@ -499,20 +568,16 @@ class ExpenseTracker:
             status = "✅ Under Budget" if remaining >= 0 else "❌ Over Budget"
             st.metric("Remaining", f"${remaining:.2f}", delta=f"{status}")
 
+        if status_data["categories"] and month_limit is not None:
+            st.caption(f"An overall budget of ${month_limit:.2f} is also set for {selected_month}.")
+
         # Display budget vs actual by category
         st.markdown("### Budget vs. Actual by Category")
 
         budget_data = []
         overall_status = "within"  # Default status
 
-        for key, value in filtered_budget.items():
-            parts = key.split('-')
-            if len(parts) < 3:  # Check if key has enough parts
-                st.error(f"Invalid budget key format: {key}")
-                continue
-
-            category = parts[-1]  # Get the last part as the category
-            spent = month_df[month_df["Category"] == category]["Amount"].sum() if not month_df.empty else 0
+        for category, value, spent in status_data["categories"]:
             remaining = value - spent
             percentage = (spent / value * 100) if value > 0 else 0
             status = "✔️ Within Budget" if spent <= value else "❌ Over Budget"
@@ -608,32 +673,30 @@ class ExpenseTracker:
 
     def daily_expense(self):
         st.subheader("Today's Expense")
-        today = datetime.date.today().strftime('%Y-%m-%d')
-        df = pd.DataFrame(self.expenses, columns=["Date", "Category", "Amount"])
-        df = df[df["Date"] == today]
+        today = datetime.date.today()
+        df = self.expenses.frame()
+        first, stop = frame_span(df, today, today + datetime.timedelta(days=1))
+        df = df.iloc[first:stop][["Date", "Category", "Amount", "Cents"]]
 
         if df.empty:
             st.write("No expenses recorded for today.")
         else:
-            st.dataframe(df)
-            total_expense_today = df["Amount"].sum()
+            st.dataframe(df.drop(columns="Cents"))
+            total_expense_today = from_cents(df["Cents"].sum())
             st.write(f"### Total Expense for Today: ${total_expense_today:.2f}")
 
     def generate_report(self):
         st.subheader("Expense Reports")
 
         # Create DataFrame from expenses
-        if not self.expenses:
+        if not len(self.expenses):
             st.warning("No expenses recorded yet. Please add some expenses to generate reports.")
             return
 
-        df = pd.DataFrame(self.expenses, columns=["Date", "Category", "Amount"])
-        df["Date"] = pd.to_datetime(df["Date"])
-        df["Year"] = df["Date"].dt.year
-        df["Month"] = df["Date"].dt.month
-        df["Week"] = df["Date"].dt.isocalendar().week
-        df["Month_Name"] = df["Date"].dt.strftime('%B')
-        df["Day"] = df["Date"].dt.day
+        # Period data comes from storage range queries; the filters only need
+        # the distinct month keys
+        keys = pd.unique(self.expenses.months)
+        year_col, month_col = split_month_key(keys)
 
         # Report type selection
         report_type = st.radio(
@@ -643,20 +706,16 @@ class ExpenseTracker:
         )
 
         # Get data for filters
-        years = sorted(df["Year"].unique(), reverse=True)
-        months = sorted(df["Month"].unique())
+        years = sorted({int(y) for y in year_col}, reverse=True)
+        months = sorted({int(m) for m in month_col})
         month_names = [datetime.date(2000, m, 1).strftime('%B') for m in months]
 
-        # Initialize report data
-        report_data = None
-        report_title = ""
-        period_name = ""
+        # The widgets pick the period; core.build_report gathers its data
+        report = None
 
         if report_type == "Yearly":
             selected_year = st.selectbox("Select Year", years)
-            period_name = str(selected_year)
-            report_title = f"Yearly Expense Report - {selected_year}"
-            report_data = df[df["Year"] == selected_year].copy()
+            report = core.build_report(self.storage, report_type, selected_year)
 
         elif report_type == "Monthly":
             col1, col2 = st.columns(2)
@@ -667,12 +726,9 @@ class ExpenseTracker:
                 available_months = [datetime.date(2000, m, 1).strftime('%B') for m in range(1, current_month + 1)]
                 selected_month = st.selectbox("Select Month", available_months, index=current_month - 1)
 
-            period_name = f"{selected_month} {selected_year}"
-            report_title = f"Monthly Expense Report - {selected_month} {selected_year}"
-
             # Convert month name to number
             month_num = datetime.datetime.strptime(selected_month, '%B').month
-            report_data = df[(df["Year"] == selected_year) & (df["Month"] == month_num)].copy()
+            report = core.build_report(self.storage, report_type, selected_year, month=month_num)
 
         elif report_type == "Weekly":
             col1, col2 = st.columns(2)
@@ -680,19 +736,16 @@ class ExpenseTracker:
                 selected_year = st.selectbox("Select Year", years, key="weekly_year")
 
             # Get available weeks for the selected year
-            available_weeks = sorted(df[df["Year"] == selected_year]["Week"].unique())
+            year_df = self.storage.query_expenses(*year_range(selected_year))
+            week_col = year_df["Date"].dt.isocalendar().week
+            available_weeks = sorted(week_col.unique())
             with col2:
                 if not available_weeks:
                     st.warning(f"No expense data found for {selected_year}.")
                     return
                 selected_week = st.selectbox("Select Week Number", available_weeks)
 
-            week_start = df[(df["Year"] == selected_year) & (df["Week"] == selected_week)]["Date"].min()
-            week_end = df[(df["Year"] == selected_year) & (df["Week"] == selected_week)]["Date"].max()
-
-            period_name = f"Week {selected_week} ({week_start.strftime('%b %d')} - {week_end.strftime('%b %d')})"
-            report_title = f"Weekly Expense Report - {period_name}"
-            report_data = df[(df["Year"] == selected_year) & (df["Week"] == selected_week)].copy()
+            report = core.build_report(self.storage, report_type, selected_year, week=selected_week)
 
         elif report_type == "Daily":
             col1, col2, col3 = st.columns(3)
@@ -708,8 +761,8 @@ class ExpenseTracker:
                 month_num = datetime.datetime.strptime(selected_month, '%B').month
 
                 # Get available days for the selected month and year
-                filtered_df = df[(df["Year"] == selected_year) & (df["Month"] == month_num)]
-                available_days = sorted(filtered_df["Day"].unique())
+                filtered_df = self.storage.query_expenses(*month_range(selected_year, month_num))
+                available_days = sorted(filtered_df["Date"].dt.day.unique())
 
                 if not available_days:
                     st.warning(f"No expenses found for {selected_month} {selected_year}.")
@@ -718,25 +771,27 @@ class ExpenseTracker:
                 with col3:
                     selected_date = st.date_input("Select Day", min_value=datetime.date(selected_year, month_num, 1), max_value=datetime.date.today())
 
-                # Create date safely
-                period_name = selected_date.strftime('%B %d, %Y')
-                report_title = f"Daily Expense Report - {period_name}"
-                report_data = df[df["Date"].dt.date == selected_date].copy()
+                report = core.build_report(self.storage, report_type, selected_year, day=selected_date)
 
             except (ValueError, IndexError) as e:
                 st.error(f"Error processing date: {str(e)}")
                 return
 
-        if report_data is None or report_data.empty:
+        if report is None:
             st.warning(f"No expenses found for the selected {report_type.lower()} period.")
             return
 
+        report_title = report["title"]
+        period_name = report["period_name"]
+        report_data = report["data"]
+        category_summary = report["category_summary"]
+        total_spent = report["total_spent"]
+
         # Generate Report
         st.markdown(f"## {report_title}")
 
         # 1. Summary section
         st.markdown("### Summary")
-        total_spent = report_data["Amount"].sum()
         categories = report_data["Category"].unique()
         num_transactions = len(report_data)
 
@@ -750,10 +805,6 @@ class ExpenseTracker:
 
         # 2. Category breakdown
         st.markdown("### Expense Breakdown by Category")
-        category_summary = report_data.groupby("Category")["Amount"].sum().reset_index()
-        category_summary["Percentage"] = (category_summary["Amount"] / total_spent * 100).round(1)
-        category_summary = category_summary.sort_values("Amount", ascending=False)
-
         # Display as table
         st.dataframe(
             category_summary.rename(columns={"Amount": "Total ($)", "Percentage": "% of Spending"})
@@ -764,21 +815,17 @@ class ExpenseTracker:
         # 3. Budget Comparison
         st.markdown("### Budget Analysis")
 
+        # Charts are cached as PNGs per report period and data version, so
+        # reruns that don't change either reuse them (the PDF reuses the pie).
+        # The period key, not the display name: weekly names have no year
+        chart_key = report["period"] + (self.expenses.version,)
+
         col1, col2 = st.columns(2)
 
         # Category Pie Chart
         with col1:
             st.markdown("#### Spending by Category")
-            fig, ax = plt.subplots(figsize=(8, 8))
-            plt.pie(
-                category_summary["Amount"],
-                labels=category_summary["Category"],
-                autopct='%1.1f%%',
-                startangle=90,
-                shadow=True
-            )
-            plt.axis('equal')
-            st.pyplot(fig)
+            st.image(charts.category_pie(category_summary, key=chart_key), width="stretch")
 
         # Budget comparison bar chart
         with col2:
@@ -791,8 +838,7 @@ class ExpenseTracker:
                     # Ensure month_num is defined in case we're not in the Daily section
                     month_num = datetime.datetime.strptime(selected_month, '%B').month
 
-                budget_key_prefix = f"{selected_year}-{month_num:02d}"
-                period_budget = {k.split('-')[-1]: v for k, v in self.budget.items() if k.startswith(budget_key_prefix)}
+                period_budget = self.budget.for_month(f"{selected_year}-{month_num:02d}")
 
                 if period_budget:
                     budget_data = []
@@ -803,22 +849,10 @@ class ExpenseTracker:
 
                     budget_df = pd.DataFrame(budget_data, columns=["Category", "Budget", "Actual"])
 
-                    fig, ax = plt.subplots(figsize=(8, 8))
-                    x = range(len(budget_df))
-                    width = 0.35
-
-                    ax.bar([i - width/2 for i in x], budget_df["Budget"], width, label='Budget')
-                    ax.bar([i + width/2 for i in x], budget_df["Actual"], width, label='Actual')
-
-                    ax.set_xlabel('Category')
-                    ax.set_ylabel('Amount ($)')
-                    ax.set_title('Budget vs. Actual Spending')
-                    ax.set_xticks(x)
-                    ax.set_xticklabels(budget_df["Category"], rotation=45, ha="right")
-                    ax.legend()
-
-                    fig.tight_layout()
-                    st.pyplot(fig)
+                    # The budgets are part of the key: they can change without
+                    # the expenses changing
+                    budget_key = chart_key + (tuple(sorted(period_budget.items())),)
+                    st.image(charts.budget_bars(budget_df, key=budget_key), width="stretch")
                 else:
                     st.info("No budget data available for this period.")
             else:
@@ -827,50 +861,23 @@ class ExpenseTracker:
         # 4. Spending Trends
         st.markdown("### Spending Trends")
 
+        # Yearly reports trend by month, monthly by day, weekly by weekday
+        trends = core.trend(report_type, report_data)
         if report_type in ["Yearly", "Monthly"]:
+            trends_df, x_axis = trends
             if report_type == "Yearly":
-                # For yearly report, group by month
-                trends_df = report_data.groupby(["Month_Name"])["Amount"].sum().reset_index()
-                # Ensure proper month ordering
-                month_order = {month: i for i, month in enumerate([
-                    'January', 'February', 'March', 'April', 'May', 'June',
-                    'July', 'August', 'September', 'October', 'November', 'December'
-                ])}
-                trends_df = trends_df.sort_values(by="Month_Name", key=lambda x: x.map(month_order))
-                x_axis = "Month_Name"
                 plt_title = f"Monthly Spending Trends for {selected_year}"
             else:
-                # For monthly report, group by day
-                trends_df = report_data.groupby(["Day"])["Amount"].sum().reset_index()
-                trends_df = trends_df.sort_values("Day")
-                x_axis = "Day"
                 plt_title = f"Daily Spending Trends for {period_name}"
 
-            fig, ax = plt.subplots(figsize=(10, 6))
-            sns.lineplot(data=trends_df, x=x_axis, y="Amount", marker='o', linewidth=2, ax=ax)
-            plt.title(plt_title)
-            plt.ylabel("Amount ($)")
-            plt.grid(True, linestyle='--', alpha=0.7)
-            plt.xticks(rotation=45)
-            fig.tight_layout()
-            st.pyplot(fig)
+            st.image(charts.trend_line(trends_df, x_axis, plt_title, key=chart_key), width="stretch")
 
         elif report_type == "Weekly":
-            # For weekly report, group by day of week
-            report_data["DayOfWeek"] = report_data["Date"].dt.day_name()
-            day_order = {day: i for i, day in enumerate([
-                'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'
-            ])}
-            trends_df = report_data.groupby(["DayOfWeek"])["Amount"].sum().reset_index()
-            trends_df = trends_df.sort_values(by="DayOfWeek", key=lambda x: x.map(day_order))
-
-            fig, ax = plt.subplots(figsize=(10, 6))
-            sns.barplot(data=trends_df, x="DayOfWeek", y="Amount", ax=ax)
-            plt.title(f"Spending Trend for {period_name}")
-            plt.ylabel("Amount ($)")
-            plt.xlabel("Day of Week")
-            plt.tight_layout()
-            st.pyplot(fig)
+            trends_df, _ = trends
+            st.image(
+                charts.weekday_bars(trends_df, f"Spending Trend for {period_name}", key=chart_key),
+                width="stretch"
+            )
 
         # 5. Detailed Transactions
         st.markdown("### Detailed Transactions")
@@ -882,122 +889,50 @@ class ExpenseTracker:
         # 6. Download Report
         st.markdown("### Download Report")
 
-        if st.button("Generate PDF Report"):
-            pdf_buffer = self.create_pdf_report(report_title, period_name, report_data, category_summary, total_spent)
-
-            # Create download link
-            b64_pdf = base64.b64encode(pdf_buffer.getvalue()).decode()
-            file_name = f"expense_report_{report_type.lower()}_{period_name.replace(' ', '_')}.pdf"
-            href = f'<a href="data:application/pdf;base64,{b64_pdf}" download="{file_name}">Download PDF Report</a>'
-            st.markdown(href, unsafe_allow_html=True)
-
-    def create_pdf_report(self, report_title, period_name, report_data, category_summary, total_spent):
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        elements = []
-
-        # Define styles
-        styles = getSampleStyleSheet()
-        title_style = styles["Title"]
-        heading_style = styles["Heading1"]
-        normal_style = styles["Normal"]
-
-        # Add title
-        elements.append(Paragraph(report_title, title_style))
-        elements.append(Spacer(1, 0.25*inch))
-
-        # Add summary section
-        elements.append(Paragraph("Expense Summary", heading_style))
-        summary_text = f"""
-        Period: {period_name}
-        Total Spent: ${total_spent:.2f}
-        Number of Transactions: {len(report_data)}
-        Number of Categories: {len(report_data['Category'].unique())}
-        """
-        elements.append(Paragraph(summary_text, normal_style))
-        elements.append(Spacer(1, 0.25*inch))
-
-        # Category breakdown
-        elements.append(Paragraph("Expense Breakdown by Category", heading_style))
-
-        # Create category table
-        category_data = [["Category", "Amount ($)", "Percentage (%)"]]
-        for _, row in category_summary.iterrows():
-            category_data.append([
-                row["Category"],
-                f"${row['Amount']:.2f}",
-                f"{row['Percentage']:.1f}%"
-            ])
+        # PDFs are built by a background worker; the session keeps the job id
+        # per report period and data version so the status survives reruns,
+        # and a PDF of older data is not offered once the expenses change
+        file_name = f"expense_report_{report_type.lower()}_{period_name.replace(' ', '_')}.pdf"
+        if 'pdf_jobs' not in st.session_state:
+            st.session_state.pdf_jobs = {}
+        # Jobs for an older version of the data are never shown again
+        st.session_state.pdf_jobs = {
+            key: job for key, job in st.session_state.pdf_jobs.items() if key[-1] == self.expenses.version
+        }
 
-        # Create the table
-        table = Table(category_data, colWidths=[2*inch, 1.5*inch, 1.5*inch])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-
-        elements.append(table)
-        elements.append(Spacer(1, 0.25*inch))
-
-        # Create category pie chart
-        elements.append(Paragraph("Spending Distribution", heading_style))
-
-        fig, ax = plt.subplots(figsize=(7, 7))
-        plt.pie(
-            category_summary["Amount"],
-            labels=category_summary["Category"],
-            autopct='%1.1f%%',
-            startangle=90,
-            shadow=True
-        )
-        plt.axis('equal')
-        plt.title("Expense Distribution by Category")
-
-        # Save plot to a temporary buffer
-        img_buffer = io.BytesIO()
-        plt.savefig(img_buffer, format='png')
-        img_buffer.seek(0)
-
-        # Add the image to the PDF
-        img = Image(img_buffer, width=6*inch, height=6*inch)
-        elements.append(img)
-
-        # Add detailed transactions
-        elements.append(Paragraph("Detailed Transactions", heading_style))
-
-        # Format transaction data
-        transaction_data = [["Date", "Category", "Amount"]]
-        sorted_data = report_data.sort_values("Date", ascending=False)
-        for _, row in sorted_data.iterrows():
-            transaction_data.append([
-                row["Date"].strftime('%Y-%m-%d'),
-                row["Category"],
-                f"${row['Amount']:.2f}"
-            ])
+        if st.button("Generate PDF Report"):
+            st.session_state.pdf_jobs[chart_key] = reports.submit_pdf_report(
+                report_title, period_name, report_data, category_summary, total_spent,
+                chart_key=chart_key
+            )
 
-        # Create the transaction table
-        trans_table = Table(transaction_data, colWidths=[1.5*inch, 2*inch, 1.5*inch])
-        trans_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-
-        elements.append(trans_table)
-
-        # Generate PDF
-        doc.build(elements)
-        buffer.seek(0)
-        return buffer
+        job_id = st.session_state.pdf_jobs.get(chart_key)
+        if job_id is not None:
+            self.pdf_job_ui(chart_key, job_id, file_name)
+
+    def pdf_job_ui(self, job_key, job_id, file_name):
+        status = reports.job_status(job_id)
+
+        if status == "running":
+            # Poll in a fragment so only this part reruns until the job is done
+            @st.fragment(run_every=1)
+            def poll_pdf_job():
+                if reports.job_status(job_id) != "running":
+                    st.rerun()
+                st.info("⏳ Generating PDF report in the background...")
+
+            poll_pdf_job()
+        elif status == "done":
+            st.download_button(
+                "Download PDF Report",
+                data=reports.job_result(job_id),
+                file_name=file_name,
+                mime="application/pdf",
+            )
+        elif status == "failed":
+            st.error(f"🚨 Error: PDF generation failed: {reports.job_error(job_id)}")
+        else:
+            st.session_state.pdf_jobs.pop(job_key, None)
 
 if __name__ == "__main__":
     ExpenseTracker()
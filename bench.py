@@ -0,0 +1,349 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import numpy as np
+import pandas as pd
+
+import charts
+import core
+import reports
+from categories import DEFAULT_CATEGORIES
+from snapshot import SNAPSHOT_FORMATS
+from storage import COLUMNS, CsvStorage, invalidate_cache
+from store import frame_span, month_range, split_month_key, year_range
+
+# Benchmarks for the storage, analytics, chart and PDF paths on synthetic
+# expense histories:
+#
+#   python bench.py --sizes 1k,100k,1M --output bench.json
+#   python bench.py --baseline bench_baseline.json      # exit 1 on regression
+#   python bench.py --save-baseline bench_baseline.json
+#   python bench.py --sizes 1k --leak-check             # also the (slow) leak check
+#
+# Each size gets its own expenses.csv / budget.csv under --data-dir, which
+# are generated once and reused. Every step is timed --repeat times;
+# "seconds" is the fastest run and "first_seconds" the first one, which
+# includes building lazy caches (frame, month totals). Peak memory comes
+# from one extra run under tracemalloc, so it does not slow the timings.
+# The <format>_load and <format>_monthly steps time cold loads and a cold
+# monthly query against each available snapshot format (see snapshot.py).
+
+CATEGORIES = list(DEFAULT_CATEGORIES)
+FIRST_YEAR = 2019
+YEARS = 6
+
+# A step regresses when it is this much slower (or bigger) than baseline,
+# and by more than the noise floor below.
+TOLERANCE = 0.25
+NOISE_FLOOR = {"seconds": 0.005, "peak_mb": 1.0}
+
+# Full reports (every chart type plus the PDF) rendered by --leak-check,
+# and the RSS growth it allows.
+LEAK_RENDERS = 1000
+LEAK_LIMIT_MB = 10
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="bench.py", description="Expense tracker benchmarks")
+    parser.add_argument("--sizes", default="1k,100k,1M", help="comma-separated row counts, e.g. 1k,100k,1M,10M")
+    parser.add_argument("--data-dir", default="bench_data", help="where generated histories are kept")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per step")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc peak memory runs")
+    parser.add_argument("--pdf-max-rows", type=int, default=5000,
+                        help="skip the PDF step when its report has more rows")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--save-baseline", metavar="FILE", help="also write the results to FILE")
+    parser.add_argument("--leak-check", type=int, nargs="?", const=LEAK_RENDERS, metavar="RENDERS",
+                        help=f"also render RENDERS full reports (default {LEAK_RENDERS}) and fail if RSS grows "
+                             f"more than {LEAK_LIMIT_MB}MB; slow")
+    args = parser.parse_args(argv)
+
+    results = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+        },
+        "sizes": {},
+    }
+    for rows in [parse_size(size) for size in args.sizes.split(",")]:
+        directory = ensure_history(args.data_dir, rows)
+        print(f"== {rows:,} rows ({directory})", file=sys.stderr)
+        results["sizes"][str(rows)] = run_steps(directory, rows, args)
+    if args.leak_check is not None:
+        results["figure_leak"] = figure_leak_check(args.leak_check)
+        print(f"== figure leak check: {results['figure_leak']}", file=sys.stderr)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.tolerance)
+        for line in regressions:
+            print("REGRESSION " + line, file=sys.stderr)
+        if regressions:
+            return 1
+    growth = results.get("figure_leak", {}).get("rss_growth_mb")
+    if growth is not None and growth > LEAK_LIMIT_MB:
+        print(f"REGRESSION figure leak: RSS grew {growth:.1f}MB "
+              f"over {results['figure_leak']['renders']} report renders", file=sys.stderr)
+        return 1
+    return 0
+
+
+def parse_size(size):
+    size = size.strip().lower()
+    for suffix, factor in (("k", 1_000), ("m", 1_000_000)):
+        if size.endswith(suffix):
+            return int(float(size[:-1]) * factor)
+    return int(size)
+
+
+def ensure_history(data_dir, rows, seed=0):
+    """Generate (once) a synthetic history of ``rows`` expenses and return its directory.
+
+    Dates are spread evenly over YEARS years from FIRST_YEAR across the five
+    categories, and every month has a budget for each category.
+    """
+    directory = os.path.join(data_dir, str(rows))
+    expenses_path = os.path.join(directory, "expenses.csv")
+    budget_path = os.path.join(directory, "budget.csv")
+    if os.path.exists(expenses_path) and os.path.exists(budget_path):
+        return directory
+
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    start = np.datetime64(f"{FIRST_YEAR}-01-01")
+    days = (np.datetime64(f"{FIRST_YEAR + YEARS}-01-01") - start).astype(int)
+    df = pd.DataFrame({
+        "Date": np.sort(start + rng.integers(0, days, rows)),
+        "Category": np.asarray(CATEGORIES)[rng.integers(0, len(CATEGORIES), rows)],
+        "Amount": np.round(rng.lognormal(3, 1, rows), 2),
+    })
+    df[COLUMNS].to_csv(expenses_path, index=False, date_format="%Y-%m-%d")
+
+    months = pd.period_range(f"{FIRST_YEAR}-01", periods=YEARS * 12, freq="M").strftime("%Y-%m")
+    budget = {f"{month}-{category}": float(rng.integers(100, 5000)) for month in months for category in CATEGORIES}
+    pd.DataFrame.from_dict(budget, orient="index", columns=["Budget"]).to_csv(budget_path)
+    return directory
+
+
+def run_steps(directory, rows, args):
+    expenses_path = os.path.join(directory, "expenses.csv")
+    budget_path = os.path.join(directory, "budget.csv")
+    storage = CsvStorage(expenses_path, budget_path)
+    last_year = FIRST_YEAR + YEARS - 1
+
+    def load():
+        invalidate_cache()
+        fresh = CsvStorage(expenses_path, budget_path)
+        fresh.load_expenses()
+        fresh.load_budget()
+        return rows
+
+    def snapshot_load(snapshot):
+        def step():
+            invalidate_cache()
+            CsvStorage(expenses_path, budget_path, snapshot=snapshot).load_expenses()
+            return rows
+        return step
+
+    def snapshot_monthly(snapshot):
+        # A cold process asking for one month: reads only that part of the snapshot
+        def step():
+            invalidate_cache()
+            storage = CsvStorage(expenses_path, budget_path, snapshot=snapshot)
+            return len(storage.query_expenses(*month_range(last_year, 6)))
+        return step
+
+    def view():
+        # What View Expenses computes: metrics from the running totals, the
+        # year list and the filtered expense list (date-range slices)
+        store = storage.load_expenses()
+        store.total(last_year)
+        store.total(last_year, 6)
+        store.total(last_year, 6, "Food")
+        df = store.frame()
+        split_month_key(df["MonthKey"])
+        first, stop = frame_span(df, *year_range(last_year))
+        df.iloc[first:stop]
+        first, stop = frame_span(df, *month_range(last_year, 6))
+        month_df = df.iloc[first:stop]
+        month_df[month_df["Category"] == "Food"]
+        return rows
+
+    def budget_summary():
+        store, budget = storage.load_expenses(), storage.load_budget()
+        for month in range(1, 13):
+            core.budget_status(store, budget, f"{last_year}-{month:02d}")
+        return rows
+
+    def report(report_type, **period):
+        def step():
+            data = core.build_report(storage, report_type, last_year, **period)
+            if data is None:
+                return 0
+            core.trend(report_type, data["data"])
+            return len(data["data"])
+        return step
+
+    monthly = core.build_report(storage, "Monthly", last_year, month=6)
+    daily = core.build_report(storage, "Daily", last_year, day=_busiest_day(storage, last_year))
+
+    def chart_render():
+        charts.category_pie(monthly["category_summary"])
+        charts.trend_line(*core.trend("Monthly", monthly["data"]), "Trend")
+        return len(monthly["data"])
+
+    def chart_cached():
+        key = monthly["period"] + (storage.load_expenses().version,)
+        charts.category_pie(monthly["category_summary"], key=key)
+        charts.trend_line(*core.trend("Monthly", monthly["data"]), "Trend", key=key)
+        return len(monthly["data"])
+
+    def pdf():
+        reports.create_pdf_report(
+            daily["title"], daily["period_name"], daily["data"], daily["category_summary"], daily["total_spent"]
+        )
+        return len(daily["data"])
+
+    steps = [("load", load)]
+    for snapshot, snapshot_class in SNAPSHOT_FORMATS.items():
+        if snapshot_class.available():
+            # Make sure the snapshot exists and matches the CSV
+            invalidate_cache()
+            CsvStorage(expenses_path, budget_path, snapshot=snapshot).load_expenses()
+            steps += [(f"{snapshot}_load", snapshot_load(snapshot)), (f"{snapshot}_monthly", snapshot_monthly(snapshot))]
+    steps += [
+        ("view_expenses", view),
+        ("budget_summary", budget_summary),
+        ("report_yearly", report("Yearly")),
+        ("report_monthly", report("Monthly", month=6)),
+        ("report_weekly", report("Weekly", week=26)),
+        ("report_daily", report("Daily", day=_busiest_day(storage, last_year))),
+        ("charts", chart_render),
+        ("charts_cached", chart_cached),
+    ]
+    if len(daily["data"]) <= args.pdf_max_rows:
+        steps.append(("pdf_daily", pdf))
+    else:
+        print(f"   pdf_daily skipped: {len(daily['data']):,} rows > --pdf-max-rows", file=sys.stderr)
+
+    results = {}
+    for name, step in steps:
+        results[name] = measure(step, args.repeat, not args.no_memory)
+        result = results[name]
+        peak = f"{result['peak_mb']:8.1f}MB" if "peak_mb" in result else ""
+        print(f"   {name:<16} {result['seconds']:9.4f}s  first {result['first_seconds']:9.4f}s  "
+              f"{result['rows_per_second']:14,.0f} rows/s {peak}", file=sys.stderr)
+    return results
+
+
+def measure(step, repeat, memory=True):
+    """Time ``step`` (which returns the rows it processed) and its peak memory."""
+    timings = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        processed = step()
+        timings.append(time.perf_counter() - start)
+    result = {
+        "seconds": min(timings),
+        "first_seconds": timings[0],
+        "rows": processed,
+        "rows_per_second": processed / min(timings) if min(timings) else 0.0,
+    }
+    if memory:
+        tracemalloc.start()
+        try:
+            step()
+            result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def figure_leak_check(renders=LEAK_RENDERS):
+    """Render full reports repeatedly and report how much the process RSS grew.
+
+    Each render draws the pie, budget and trend charts uncached, as a report
+    screen does on a miss, and builds the PDF report.
+    """
+    if resource is None:
+        return {"renders": 0, "rss_growth_mb": None}
+    amounts = [1.0, 2.0, 3.0, 4.0, 5.0]
+    data = pd.DataFrame({
+        "Date": pd.date_range(f"{FIRST_YEAR}-01-01", periods=len(CATEGORIES)),
+        "Category": CATEGORIES,
+        "Amount": amounts,
+    })
+    summary = pd.DataFrame({
+        "Category": CATEGORIES, "Amount": amounts, "Percentage": [100 * a / sum(amounts) for a in amounts],
+    })
+    budget = pd.DataFrame({"Category": CATEGORIES, "Budget": [3.0] * len(CATEGORIES), "Actual": amounts})
+    trend = pd.DataFrame({"Day": range(1, len(CATEGORIES) + 1), "Amount": amounts})
+
+    def render():
+        charts.category_pie(summary)
+        charts.budget_bars(budget)
+        charts.trend_line(trend, "Day", "Trend")
+        reports.create_pdf_report("Leak check", "Period", data, summary, sum(amounts))
+
+    render()  # warm up imports, fonts and the figure pool
+    before = _max_rss_mb()
+    for _ in range(renders):
+        render()
+    return {"renders": renders, "rss_growth_mb": _max_rss_mb() - before}
+
+
+def compare(baseline, results, tolerance):
+    """Return a line per step that got slower or bigger than ``baseline`` allows."""
+    regressions = []
+    for size, steps in results["sizes"].items():
+        for name, result in steps.items():
+            before = baseline.get("sizes", {}).get(size, {}).get(name)
+            if before is None:
+                continue
+            for metric, floor in NOISE_FLOOR.items():
+                if metric not in result or metric not in before:
+                    continue
+                if result[metric] > before[metric] * (1 + tolerance) and result[metric] - before[metric] > floor:
+                    regressions.append(
+                        f"{size} rows {name} {metric}: {before[metric]:.4f} -> {result[metric]:.4f}"
+                    )
+    return regressions
+
+
+def _busiest_day(storage, year):
+    dates = storage.load_expenses().dates
+    in_year = dates[dates.astype("datetime64[Y]").astype(int) + 1970 == year]
+    values, counts = np.unique(in_year, return_counts=True)
+    return values[np.argmax(counts)].item()
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+class Budget:
+    """Monthly budgets indexed by month, then category.
+
+    Months are ``YYYY-MM`` strings. ``budget.csv`` (and older versions of the
+    app) use flat keys such as ``2025-02-Food``; a key holding only the month,
+    e.g. ``2025-02``, is a legacy budget for the whole month and is kept
+    apart from the per-category budgets.
+
+    The budget remembers which ``(month, category)`` keys were set since it
+    was loaded or last saved (category "" for month limits), so saving can
+    re-read what other processes saved meanwhile and apply only this
+    session's changes on top (``rebase``).
+    """
+
+    def __init__(self):
+        self._by_month = {}
+        self._month_limits = {}
+        self._changed = set()
+
+    @classmethod
+    def from_flat(cls, mapping):
+        """Build a Budget from ``{"2025-02-Food": 100.0, "2025-02": 500.0}``."""
+        budget = cls()
+        for key, amount in mapping.items():
+            month, category = split_key(key)
+            if category:
+                budget.set(month, category, amount)
+            else:
+                budget.set_month_limit(month, amount)
+        budget.mark_saved()
+        return budget
+
+    def to_flat(self):
+        """Return the budgets in the flat key format used by ``budget.csv``."""
+        flat = dict(self._month_limits)
+        for month, categories in self._by_month.items():
+            for category, amount in categories.items():
+                flat[f"{month}-{category}"] = amount
+        return flat
+
+    def rows(self):
+        """Yield ``(month, category, amount)``; category is "" for month limits."""
+        for month, amount in self._month_limits.items():
+            yield month, "", amount
+        for month, categories in self._by_month.items():
+            for category, amount in categories.items():
+                yield month, category, amount
+
+    def changes(self):
+        """Yield ``(month, category, amount)`` for every budget set since the last save."""
+        for month, category in sorted(self._changed):
+            if category:
+                yield month, category, self._by_month[month][category]
+            else:
+                yield month, "", self._month_limits[month]
+
+    def rebase(self, saved):
+        """Replace the budgets with ``saved`` plus the ones changed here since the last save."""
+        changes = list(self.changes())
+        self._by_month = {month: dict(categories) for month, categories in saved._by_month.items()}
+        self._month_limits = dict(saved._month_limits)
+        for month, category, amount in changes:
+            if category:
+                self.set(month, category, amount)
+            else:
+                self.set_month_limit(month, amount)
+
+    def mark_saved(self):
+        self._changed.clear()
+
+    def mark_unsaved(self):
+        """Treat every budget as changed, e.g. to copy them all to another storage."""
+        self._changed = {(month, category) for month, category, _ in self.rows()}
+
+    def set(self, month, category, amount):
+        self._by_month.setdefault(month, {})[category] = float(amount)
+        self._changed.add((month, category))
+
+    def get(self, month, category, default=None):
+        return self._by_month.get(month, {}).get(category, default)
+
+    def for_month(self, month):
+        """Return ``{category: amount}`` for ``month`` (empty if none are set)."""
+        return self._by_month.get(month, {})
+
+    def set_month_limit(self, month, amount):
+        self._month_limits[month] = float(amount)
+        self._changed.add((month, ""))
+
+    def month_limit(self, month):
+        """Return the legacy whole-month budget for ``month``, if any."""
+        return self._month_limits.get(month)
+
+    def months(self):
+        """Return every month that has a budget, sorted."""
+        return sorted(set(self._by_month) | set(self._month_limits))
+
+    def __len__(self):
+        return sum(len(categories) for categories in self._by_month.values()) + len(self._month_limits)
+
+
+def split_key(key):
+    """Split a flat budget key into ``(month, category)``.
+
+    ``"2025-02-Food"`` gives ``("2025-02", "Food")`` and ``"2025-02"`` gives
+    ``("2025-02", "")``.
+    """
+    return key[:7], key[8:]
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+# Categories every user starts with. Users can register their own (see
+# CategoryRegistry.add); the storage backends save those next to the data.
+DEFAULT_CATEGORIES = ("Food", "Transport", "Entertainment", "Shopping", "Bills")
+
+
+class CategoryRegistry:
+    """Ordered set of expense category names, each with a small-int code.
+
+    A category's code is its position in the registry, so codes never change
+    once given out and fit the ``int8`` code column of ExpenseStore (at most
+    MAX_CATEGORIES names). Names are matched case-insensitively: looking up
+    or adding "food" finds "Food".
+    """
+
+    MAX_CATEGORIES = int(np.iinfo(np.int8).max) + 1
+
+    def __init__(self, names=DEFAULT_CATEGORIES):
+        self._names = []
+        self._codes = {}
+        self._dtype = None
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        """Register ``name`` if it is new and return its registered spelling.
+
+        Raises ValueError for an empty name or when the registry is full.
+        """
+        name = str(name).strip()
+        if not name:
+            raise ValueError("Category name is empty")
+        existing = self.lookup(name)
+        if existing is not None:
+            return existing
+        if len(self._names) >= self.MAX_CATEGORIES:
+            raise ValueError(f"Too many categories to add {name!r}")
+        self._codes[name.lower()] = len(self._names)
+        self._names.append(name)
+        self._dtype = None
+        return name
+
+    def lookup(self, name):
+        """Return the registered spelling of ``name``, or None."""
+        code = self.code(name)
+        return None if code is None else self._names[code]
+
+    def code(self, name):
+        """Return the code of ``name``, or None if it is not registered."""
+        return self._codes.get(str(name).strip().lower())
+
+    def name(self, code):
+        return self._names[code]
+
+    def names(self):
+        return list(self._names)
+
+    @property
+    def dtype(self):
+        """The pandas CategoricalDtype whose codes are the registry's codes."""
+        if self._dtype is None:
+            self._dtype = pd.CategoricalDtype(self._names)
+        return self._dtype
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __contains__(self, name):
+        return self.code(name) is not None
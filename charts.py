@@ -0,0 +1,169 @@
+import io
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import timing
+
+# Rendered report charts, as PNG bytes, shared by every session and by the
+# PDF worker threads. Keys are (chart name,) + (report type, period, data
+# version), so a chart is only drawn again when the data behind it changed.
+# The least recently used charts are dropped past CACHE_SIZE.
+CACHE_SIZE = 64
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+CACHE_STATS = {"hits": 0, "misses": 0}
+
+# Charts are drawn on matplotlib Figure objects (not pyplot, whose global
+# figure list leaks figures that aren't closed and is not thread-safe) taken
+# from a small pool and reused, so the number of live figures stays bounded
+# however many reports are rendered.
+FIGURE_POOL_SIZE = 4
+
+_figures = queue.LifoQueue()
+_figure_slots = threading.BoundedSemaphore(FIGURE_POOL_SIZE)
+
+
+def cached_png(key, draw, figsize):
+    """Return the PNG for ``key``, calling ``draw(fig)`` to render it on a miss.
+
+    A ``key`` of None always renders and caches nothing.
+    """
+    if key is not None:
+        with _cache_lock:
+            png = _cache.get(key)
+            if png is not None:
+                _cache.move_to_end(key)
+                CACHE_STATS["hits"] += 1
+                return png
+            CACHE_STATS["misses"] += 1
+
+    png = _render(draw, figsize)
+    if key is not None:
+        with _cache_lock:
+            _cache[key] = png
+            _cache.move_to_end(key)
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    return png
+
+
+def invalidate_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def cache_stats():
+    with _cache_lock:
+        return dict(CACHE_STATS, entries=len(_cache))
+
+
+@timing.timed_function("chart.render")
+def _render(draw, figsize):
+    with _pooled_figure(figsize) as fig:
+        draw(fig)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+@contextmanager
+def _pooled_figure(figsize):
+    """Lend out a cleared Figure of ``figsize`` from the figure pool.
+
+    Figures are never registered with pyplot, so nothing keeps them alive
+    but the pool: at most FIGURE_POOL_SIZE exist, and callers beyond that
+    wait for one to be handed back.
+    """
+    from matplotlib.figure import Figure, SubplotParams
+
+    _figure_slots.acquire()
+    try:
+        try:
+            fig = _figures.get_nowait()
+        except queue.Empty:
+            fig = Figure()
+        fig.set_size_inches(figsize)
+        try:
+            yield fig
+        finally:
+            # Drop the artists and any tight_layout margins before reuse
+            fig.clear()
+            fig.subplotpars = SubplotParams()
+            _figures.put(fig)
+    finally:
+        _figure_slots.release()
+
+
+def _key(name, key):
+    return None if key is None else (name,) + tuple(key)
+
+
+def category_pie(category_summary, key=None):
+    """Pie chart of spending per category."""
+    def draw(fig):
+        ax = fig.subplots()
+        ax.pie(
+            category_summary["Amount"],
+            labels=category_summary["Category"],
+            autopct='%1.1f%%',
+            startangle=90,
+            shadow=True
+        )
+        ax.axis('equal')
+
+    return cached_png(_key("pie", key), draw, (8, 8))
+
+
+def budget_bars(budget_df, key=None):
+    """Side-by-side budget and actual bars per category."""
+    def draw(fig):
+        ax = fig.subplots()
+        x = range(len(budget_df))
+        width = 0.35
+
+        ax.bar([i - width/2 for i in x], budget_df["Budget"], width, label='Budget')
+        ax.bar([i + width/2 for i in x], budget_df["Actual"], width, label='Actual')
+
+        ax.set_xlabel('Category')
+        ax.set_ylabel('Amount ($)')
+        ax.set_title('Budget vs. Actual Spending')
+        ax.set_xticks(x)
+        ax.set_xticklabels(budget_df["Category"], rotation=45, ha="right")
+        ax.legend()
+        fig.tight_layout()
+
+    return cached_png(_key("budget", key), draw, (8, 8))
+
+
+def trend_line(trends_df, x_axis, title, key=None):
+    """Line plot of spending over months or days."""
+    def draw(fig):
+        import seaborn as sns
+
+        ax = fig.subplots()
+        sns.lineplot(data=trends_df, x=x_axis, y="Amount", marker='o', linewidth=2, ax=ax)
+        ax.set_title(title)
+        ax.set_ylabel("Amount ($)")
+        ax.grid(True, linestyle='--', alpha=0.7)
+        ax.tick_params(axis='x', labelrotation=45)
+        fig.tight_layout()
+
+    return cached_png(_key("trend", key), draw, (10, 6))
+
+
+def weekday_bars(trends_df, title, key=None):
+    """Bar plot of spending per day of the week."""
+    def draw(fig):
+        import seaborn as sns
+
+        ax = fig.subplots()
+        sns.barplot(data=trends_df, x="DayOfWeek", y="Amount", ax=ax)
+        ax.set_title(title)
+        ax.set_ylabel("Amount ($)")
+        ax.set_xlabel("Day of Week")
+        fig.tight_layout()
+
+    return cached_png(_key("weekday", key), draw, (10, 6))
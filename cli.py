@@ -0,0 +1,172 @@
+import argparse
+import datetime
+import sys
+
+import core
+import importer
+import reports
+from storage import open_user_storage
+from store import from_cents, month_range, year_range
+
+# Command-line access to the expense data, without Streamlit:
+#
+#   python cli.py add 2025-02-11 Food 12.50
+#   python cli.py import statement.csv --dayfirst
+#   python cli.py categories --add Groceries
+#   python cli.py summary --month 2025-02
+#   python cli.py report monthly --year 2025 --month 2 --pdf february.pdf
+#
+# It reads and writes the same files as the app in the current directory
+# (EXPENSE_STORAGE / EXPENSE_DB select the backend, --user a user's shard).
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="cli.py", description="Smart Expense Tracker")
+    parser.add_argument("--user", help="email of the user whose storage shard to use")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="record one expense")
+    add.add_argument("date", type=_date, help="YYYY-MM-DD")
+    add.add_argument("category")
+    add.add_argument("amount", type=float)
+
+    import_ = commands.add_parser("import", help="import expenses from a CSV or bank statement")
+    import_.add_argument("file")
+    import_.add_argument("--dayfirst", action="store_true", help="dates are DD/MM/YYYY")
+
+    categories = commands.add_parser("categories", help="list categories or add your own")
+    categories.add_argument("--add", metavar="NAME", help="register a new category")
+
+    summary = commands.add_parser("summary", help="show spending by category")
+    summary.add_argument("--month", help="YYYY-MM; also compares against its budget")
+    summary.add_argument("--year", type=int)
+
+    report = commands.add_parser("report", help="print a report or write it as a PDF")
+    report.add_argument("type", choices=[t.lower() for t in core.REPORT_TYPES])
+    report.add_argument("--year", type=int, help="defaults to this year")
+    report.add_argument("--month", type=int, help="month number, for monthly reports")
+    report.add_argument("--week", type=int, help="ISO week number, for weekly reports")
+    report.add_argument("--day", type=_date, help="YYYY-MM-DD, for daily reports")
+    report.add_argument("--pdf", metavar="FILE", help="write the PDF report to FILE")
+
+    args = parser.parse_args(argv)
+    storage = open_user_storage(args.user)
+    try:
+        return COMMANDS[args.command](storage, args)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+def add_command(storage, args):
+    row_id = storage.add_expense(args.date, args.category, args.amount)
+    print(f"Added expense {row_id}: {args.date} | {args.category} | ${args.amount:.2f}")
+    return 0
+
+
+def import_command(storage, args):
+    result = importer.import_expenses(storage, args.file, dayfirst=args.dayfirst)
+    print(
+        f"Imported {result['imported']} of {result['rows']} rows "
+        f"({result['duplicates']} duplicates, {result['credits']} credits, {result['invalid']} invalid)"
+    )
+    return 0
+
+
+def categories_command(storage, args):
+    if args.add:
+        print(f"Added category {storage.add_category(args.add)}")
+    for name in storage.load_categories():
+        print(name)
+    return 0
+
+
+def summary_command(storage, args):
+    month = None
+    if args.month:
+        year, month_num = _month(args.month)
+        # "2025-2" and "2025-02" both mean the budgets' "2025-02"
+        month = f"{year}-{month_num:02d}"
+        df = storage.query_expenses(*month_range(year, month_num))
+        label = month
+    elif args.year:
+        df = storage.query_expenses(*year_range(args.year))
+        label = str(args.year)
+    else:
+        df = storage.load_expenses().frame()
+        label = "all time"
+
+    print(f"Spending for {label}: ${from_cents(df['Cents'].sum()):.2f} in {len(df)} expenses")
+    if not df.empty:
+        for _, row in core.category_summary(df).iterrows():
+            print(f"  {row['Category']:<15} ${row['Amount']:>10.2f}  {row['Percentage']:5.1f}%")
+
+    if month:
+        status = core.budget_status(storage.load_expenses(), storage.load_budget(), month)
+        if status is None:
+            print(f"No budgets set for {month}.")
+        else:
+            print(f"Budget for {month}: ${status['total_budget']:.2f}, "
+                  f"remaining ${status['total_budget'] - status['total_spent']:.2f}")
+            for category, budget, spent in status["categories"]:
+                flag = "over" if spent > budget else "ok"
+                print(f"  {category:<15} ${spent:>10.2f} of ${budget:.2f}  {flag}")
+    return 0
+
+
+def report_command(storage, args):
+    report_type = args.type.capitalize()
+    year = args.year or (args.day.year if args.day else datetime.date.today().year)
+    if report_type == "Monthly" and args.month is None:
+        raise ValueError("monthly reports need --month")
+    if report_type == "Weekly" and args.week is None:
+        raise ValueError("weekly reports need --week")
+    if report_type == "Daily" and args.day is None:
+        raise ValueError("daily reports need --day")
+
+    report = core.build_report(storage, report_type, year, month=args.month, week=args.week, day=args.day)
+    if report is None:
+        print(f"No expenses found for the selected {args.type} period.")
+        return 1
+
+    print(report["title"])
+    print(f"Total spent: ${report['total_spent']:.2f} in {len(report['data'])} expenses")
+    for _, row in report["category_summary"].iterrows():
+        print(f"  {row['Category']:<15} ${row['Amount']:>10.2f}  {row['Percentage']:5.1f}%")
+
+    if args.pdf:
+        buffer = reports.create_pdf_report(
+            report["title"], report["period_name"], report["data"],
+            report["category_summary"], report["total_spent"]
+        )
+        with open(args.pdf, "wb") as f:
+            f.write(buffer.getvalue())
+        print(f"Wrote {args.pdf}")
+    return 0
+
+
+COMMANDS = {
+    "add": add_command,
+    "import": import_command,
+    "categories": categories_command,
+    "summary": summary_command,
+    "report": report_command,
+}
+
+
+def _date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date {value!r}, expected YYYY-MM-DD")
+
+
+def _month(value):
+    try:
+        month = datetime.datetime.strptime(value, "%Y-%m")
+    except ValueError:
+        raise ValueError(f"invalid month {value!r}, expected YYYY-MM")
+    return month.year, month.month
+
+
+if __name__ == "__main__":
+    sys.exit(main())
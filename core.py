@@ -0,0 +1,126 @@
+import calendar
+import datetime
+
+import pandas as pd
+
+from store import from_cents, month_key, month_range, split_month_key, week_ranges, year_range
+
+# Expense analytics shared by the Streamlit app (app.py) and the command line
+# (cli.py). Nothing here imports streamlit. Sums are taken over the integer
+# Cents column and converted to dollars only in the results.
+
+REPORT_TYPES = ("Yearly", "Monthly", "Weekly", "Daily")
+
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+def build_report(storage, report_type, year, month=None, week=None, day=None):
+    """Return the data of one report, or None if the period has no expenses.
+
+    ``report_type`` is one of REPORT_TYPES. Yearly reports need ``year``,
+    monthly ones ``year`` and ``month``, weekly ones ``year`` and the ISO
+    ``week`` (restricted to that calendar year) and daily ones a ``day``
+    date. The result is a dict with the report ``title``, ``period_name``,
+    ``period`` (a hashable key that identifies the period, unlike the
+    display name, e.g. for caching), the period's expenses as ``data``, a
+    ``category_summary`` DataFrame (Category, Amount, Percentage; largest
+    first) and ``total_spent``.
+    """
+    if report_type == "Yearly":
+        period_name = str(year)
+        period = (report_type, year)
+        data = storage.query_expenses(*year_range(year)).copy()
+    elif report_type == "Monthly":
+        period_name = f"{calendar.month_name[month]} {year}"
+        period = (report_type, year, month)
+        data = storage.query_expenses(*month_range(year, month)).copy()
+    elif report_type == "Weekly":
+        parts = [storage.query_expenses(start, end) for start, end in week_ranges(year, week)]
+        data = pd.concat(parts) if parts else None
+        if data is None or data.empty:
+            return None
+        week_start, week_end = data["Date"].min(), data["Date"].max()
+        period_name = f"Week {week} ({week_start.strftime('%b %d')} - {week_end.strftime('%b %d')})"
+        period = (report_type, year, week)
+    elif report_type == "Daily":
+        period_name = day.strftime('%B %d, %Y')
+        period = (report_type, day)
+        data = storage.query_expenses(day, day + datetime.timedelta(days=1)).copy()
+    else:
+        raise ValueError(f"Unknown report type: {report_type}")
+
+    if data.empty:
+        return None
+    data["Month_Num"] = split_month_key(data["MonthKey"])[1]
+    data["Day"] = data["Date"].dt.day
+
+    return {
+        "title": f"{report_type} Expense Report - {period_name}",
+        "period_name": period_name,
+        "period": period,
+        "data": data,
+        "category_summary": category_summary(data),
+        "total_spent": from_cents(data["Cents"].sum()),
+    }
+
+
+def category_summary(data):
+    """Return spending per category with its share of the total, largest first."""
+    summary = _amounts_by(data, "Category", observed=True)
+    summary["Percentage"] = (summary["Amount"] / from_cents(data["Cents"].sum()) * 100).round(1)
+    return summary.sort_values("Amount", ascending=False)
+
+
+def trend(report_type, data):
+    """Return ``(trends_df, x_axis)`` for a report's spending trend chart.
+
+    Yearly reports trend by month, monthly ones by day and weekly ones by
+    day of the week. Daily reports have no trend and return None.
+    """
+    if report_type == "Yearly":
+        # Group by month number (already in calendar order)
+        trends_df = _amounts_by(data, "Month_Num")
+        trends_df["Month_Name"] = [calendar.month_name[m] for m in trends_df["Month_Num"]]
+        return trends_df, "Month_Name"
+    if report_type == "Monthly":
+        trends_df = _amounts_by(data, "Day")
+        return trends_df.sort_values("Day"), "Day"
+    if report_type == "Weekly":
+        day_order = {name: i for i, name in enumerate(DAY_NAMES)}
+        trends_df = data.assign(DayOfWeek=data["Date"].dt.day_name())
+        trends_df = _amounts_by(trends_df, "DayOfWeek")
+        return trends_df.sort_values(by="DayOfWeek", key=lambda x: x.map(day_order)), "DayOfWeek"
+    return None
+
+
+def budget_status(expenses, budget, month):
+    """Return budgets against spending for ``month`` (``YYYY-MM``), or None.
+
+    ``expenses`` is an ExpenseStore and ``budget`` a Budget. The result is a
+    dict with ``categories`` (a list of ``(category, budget, spent)``), the
+    whole-month ``month_limit`` (None if not set), ``total_budget`` (the
+    category budgets, or the month limit if there are none) and
+    ``total_spent`` over every category. None means no budget is set.
+    """
+    category_budgets = budget.for_month(month)
+    month_limit = budget.month_limit(month)
+    if not category_budgets and month_limit is None:
+        return None
+
+    year, month_num = month.split('-')
+    spent = expenses.month_category_totals(month_key(year, month_num))
+    return {
+        "categories": [
+            (category, amount, from_cents(spent.get(category, 0)))
+            for category, amount in category_budgets.items()
+        ],
+        "month_limit": month_limit,
+        "total_budget": sum(category_budgets.values()) if category_budgets else month_limit,
+        "total_spent": from_cents(sum(spent.values())),
+    }
+
+
+def _amounts_by(data, column, observed=False):
+    """Return the dollars spent per value of ``column``, summed in cents."""
+    cents = data.groupby(column, observed=observed)["Cents"].sum()
+    return from_cents(cents).rename("Amount").reset_index()
@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+
+import timing
+from store import to_cents
+
+# Rows parsed per chunk; files are streamed so their size doesn't matter.
+CHUNK_SIZE = 50_000
+
+# Header names (lower-cased) accepted for each column, in order of preference.
+# Bank statements usually have a debit/withdrawal column or a signed amount.
+DATE_COLUMNS = ("date", "transaction date", "posted date", "posting date", "value date")
+CATEGORY_COLUMNS = ("category", "type")
+AMOUNT_COLUMNS = ("amount", "debit", "withdrawal", "withdrawals", "debit amount")
+
+# Used for rows whose file has no category column.
+DEFAULT_CATEGORY = "Other"
+
+
+@timing.timed_function("import")
+def import_expenses(storage, source, chunk_size=CHUNK_SIZE, dayfirst=False, known_categories=()):
+    """Import the expenses in CSV ``source`` (a path or file object) into ``storage``.
+
+    The file is read ``chunk_size`` rows at a time and normalised column-wise:
+    dates are parsed (``dayfirst`` for DD/MM statements), categories are
+    matched case-insensitively to ``known_categories`` and the registered ones,
+    and amounts lose currency symbols and thousands separators, with
+    ``(12.50)`` read as negative. If the file's first chunk has negative
+    amounts it is taken to be a signed bank statement: negative amounts are
+    the expenses and credits are skipped. Rows that fail to parse, or whose
+    amount is zero, are skipped as invalid.
+
+    Rows already stored are skipped by hashing (date, category, amount):
+    a row is a duplicate if the file holds it no more times than storage
+    already does, so genuinely repeated expenses are kept. Everything that
+    remains is written in a single batch.
+
+    Returns a dict with the number of ``rows`` read, ``imported``,
+    ``duplicates``, ``credits`` and ``invalid`` rows. Raises ValueError,
+    importing nothing, if the file has no recognisable date or amount column
+    or more new categories than the category registry can hold.
+    """
+    store = storage.load_expenses()
+    existing_counts = _hash_counts(_row_hashes(
+        store.dates, pd.Categorical.from_codes(store.codes, categories=store.categories), store.cents
+    ))
+    categories = {name.lower(): name for name in known_categories}
+    categories.update((name.lower(), name) for name in store.categories)
+
+    result = {"rows": 0, "imported": 0, "duplicates": 0, "credits": 0, "invalid": 0}
+    seen_counts = pd.Series(dtype=np.int64)
+    signed = None
+    batches = []
+
+    reader = pd.read_csv(source, chunksize=chunk_size, dtype=str, skipinitialspace=True)
+    for chunk in reader:
+        chunk = chunk.rename(columns=lambda name: str(name).strip().lower())
+        result["rows"] += len(chunk)
+
+        dates = pd.to_datetime(_column(chunk, DATE_COLUMNS), dayfirst=dayfirst, errors="coerce")
+        amounts = _parse_amounts(_column(chunk, AMOUNT_COLUMNS))
+        category_column = _column(chunk, CATEGORY_COLUMNS, required=False)
+        if category_column is None:
+            names = pd.Series(DEFAULT_CATEGORY, index=chunk.index)
+        else:
+            names = _normalize_categories(category_column, categories)
+
+        if signed is None:
+            signed = bool((amounts < 0).any())
+        if signed:
+            credits = amounts >= 0
+            amounts = -amounts
+        else:
+            credits = pd.Series(False, index=chunk.index)
+        valid = dates.notna() & amounts.notna() & (amounts > 0) & names.notna()
+        result["credits"] += int(credits.sum())
+        result["invalid"] += int((~valid & ~credits).sum())
+
+        frame = pd.DataFrame({
+            "Date": dates[valid].to_numpy(dtype="datetime64[D]"),
+            "Category": names[valid].to_numpy(dtype=object),
+            "Amount": amounts[valid].to_numpy(dtype=np.float64),
+        })
+        if frame.empty:
+            continue
+
+        # n-th occurrence of each row in the file so far, compared with how
+        # many times storage already has it
+        hashes = pd.Series(_row_hashes(frame["Date"], frame["Category"], to_cents(frame["Amount"])))
+        occurrence = hashes.groupby(hashes).cumcount() + hashes.map(seen_counts).fillna(0).astype(np.int64)
+        new = (occurrence >= hashes.map(existing_counts).fillna(0).astype(np.int64)).to_numpy()
+        seen_counts = seen_counts.add(_hash_counts(hashes.to_numpy()), fill_value=0).astype(np.int64)
+
+        result["duplicates"] += int((~new).sum())
+        batches.append(frame[new])
+
+    if batches:
+        rows = pd.concat(batches, ignore_index=True)
+        if len(rows):
+            storage.add_expenses(rows)
+        result["imported"] = len(rows)
+    return result
+
+
+def _column(chunk, names, required=True):
+    for name in names:
+        if name in chunk.columns:
+            return chunk[name]
+    if required:
+        raise ValueError(f"No {names[0]} column found; expected one of: {', '.join(names)}")
+    return None
+
+
+def _parse_amounts(column):
+    text = column.str.strip().str.replace(r"[$€£₹,\s]", "", regex=True)
+    text = text.str.replace(r"^\((.*)\)$", r"-\1", regex=True)
+    return pd.to_numeric(text, errors="coerce")
+
+
+def _normalize_categories(column, categories):
+    """Map names to their known spelling; unknown names are title-cased."""
+    stripped = column.str.strip()
+    known = stripped.str.lower().map(categories)
+    return known.fillna(stripped.str.title()).replace("", np.nan)
+
+
+def _row_hashes(dates, categories, cents):
+    """Return a uint64 hash per (date, category, cents) row."""
+    return pd.util.hash_pandas_object(pd.DataFrame({
+        "day": np.asarray(dates, dtype="datetime64[D]").astype(np.int64),
+        "category": np.asarray(categories, dtype=object),
+        "cents": np.asarray(cents, dtype=np.int64),
+    }), index=False).to_numpy()
+
+
+def _hash_counts(hashes):
+    values, counts = np.unique(hashes, return_counts=True)
+    return pd.Series(counts, index=values)
@@ -0,0 +1,231 @@
+import io
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import charts
+import timing
+
+# PDF reports are built on a small worker pool so a large report doesn't
+# block the Streamlit script thread. Jobs are shared by every session in the
+# process; each session only keeps the ids of the jobs it submitted.
+MAX_WORKERS = 2
+MAX_JOBS = 50
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="pdf-report")
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+def submit_pdf_report(report_title, period_name, report_data, category_summary, total_spent,
+                      chart_key=None):
+    """Queue a PDF report and return its job id."""
+    future = _executor.submit(
+        create_pdf_report, report_title, period_name, report_data, category_summary, total_spent,
+        chart_key
+    )
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        _jobs[job_id] = future
+        # Forget the oldest finished jobs so their PDFs can be freed
+        for old_id in list(_jobs):
+            if len(_jobs) <= MAX_JOBS:
+                break
+            if _jobs[old_id].done():
+                del _jobs[old_id]
+    return job_id
+
+
+def job_status(job_id):
+    """Return "running", "done", "failed" or "unknown" for a job id."""
+    with _jobs_lock:
+        future = _jobs.get(job_id)
+    if future is None:
+        return "unknown"
+    if not future.done():
+        return "running"
+    return "failed" if future.exception() is not None else "done"
+
+
+def job_result(job_id):
+    """Return the PDF bytes of a finished job."""
+    with _jobs_lock:
+        future = _jobs[job_id]
+    return future.result().getvalue()
+
+
+def job_error(job_id):
+    with _jobs_lock:
+        future = _jobs[job_id]
+    return future.exception()
+
+
+@timing.timed_function("report.pdf")
+def create_pdf_report(report_title, period_name, report_data, category_summary, total_spent,
+                      chart_key=None):
+    """Build the PDF report and return it in a BytesIO.
+
+    ``chart_key`` is the key the on-screen charts were cached under; passing
+    it lets the PDF reuse the pie chart the report screen already drew.
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle, PageBreak
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib import colors
+    from reportlab.lib.units import inch
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    elements = []
+
+    # Define styles
+    styles = getSampleStyleSheet()
+    title_style = styles["Title"]
+    heading_style = styles["Heading1"]
+    normal_style = styles["Normal"]
+
+    # Add title
+    elements.append(Paragraph(report_title, title_style))
+    elements.append(Spacer(1, 0.25*inch))
+
+    # Add summary section
+    elements.append(Paragraph("Expense Summary", heading_style))
+    summary_text = f"""
+    Period: {period_name}
+    Total Spent: ${total_spent:.2f}
+    Number of Transactions: {len(report_data)}
+    Number of Categories: {len(report_data['Category'].unique())}
+    """
+    elements.append(Paragraph(summary_text, normal_style))
+    elements.append(Spacer(1, 0.25*inch))
+
+    # Category breakdown
+    elements.append(Paragraph("Expense Breakdown by Category", heading_style))
+
+    # Create category table
+    category_data = [["Category", "Amount ($)", "Percentage (%)"]]
+    for _, row in category_summary.iterrows():
+        category_data.append([
+            row["Category"],
+            f"${row['Amount']:.2f}",
+            f"{row['Percentage']:.1f}%"
+        ])
+
+    # Create the table
+    table = Table(category_data, colWidths=[2*inch, 1.5*inch, 1.5*inch])
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+
+    elements.append(table)
+    elements.append(Spacer(1, 0.25*inch))
+
+    # Create category pie chart
+    elements.append(Paragraph("Spending Distribution", heading_style))
+
+    # Add the image to the PDF
+    img_buffer = io.BytesIO(charts.category_pie(category_summary, key=chart_key))
+    img = Image(img_buffer, width=6*inch, height=6*inch)
+    elements.append(img)
+
+    # Add detailed transactions, starting on a new page
+    transactions_heading = Paragraph("Detailed Transactions", heading_style)
+    elements.append(PageBreak())
+    elements.append(transactions_heading)
+
+    # Transaction tables are generated chunk by chunk while the document is
+    # being built (see _FlowableStream), so only a few exist at a time. Each
+    # holds exactly a page of rows, so reportlab never has to split one.
+    trans_style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ])
+    def transaction_table(rows):
+        return Table([["Date", "Category", "Amount"]] + rows, colWidths=[1.5*inch, 2*inch, 1.5*inch],
+                     style=trans_style, repeatRows=1)
+
+    page_rows, first_page_rows = _rows_per_page(doc, transactions_heading, transaction_table)
+    trans_tables = (
+        transaction_table(rows) for rows in transaction_rows(report_data, page_rows, first_page_rows)
+    )
+
+    # Generate PDF
+    doc.build(_FlowableStream(elements, trans_tables))
+    buffer.seek(0)
+    return buffer
+
+
+def transaction_rows(report_data, chunk_size, first_chunk_size=None):
+    """Yield the report's transactions, newest first, as lists of formatted rows.
+
+    Every list has ``chunk_size`` rows (the last may be shorter) except the
+    first, which has ``first_chunk_size`` if given.
+    """
+    sorted_data = report_data[["Date", "Category", "Amount"]].sort_values("Date", ascending=False)
+    first_chunk_size = chunk_size if first_chunk_size is None else first_chunk_size
+    starts = [0] + list(range(first_chunk_size, len(sorted_data), chunk_size))
+    for start, stop in zip(starts, starts[1:] + [len(sorted_data)]):
+        chunk = sorted_data.iloc[start:stop]
+        yield [
+            list(row) for row in zip(
+                chunk["Date"].dt.strftime('%Y-%m-%d'),
+                chunk["Category"].astype(str),
+                chunk["Amount"].map("${:.2f}".format),
+            )
+        ]
+
+
+def _rows_per_page(doc, heading, make_table):
+    """Return how many table rows fit on a page of ``doc``, and on a page that starts with ``heading``.
+
+    Row heights are measured on sample tables from ``make_table``, inside the
+    padding of the frame SimpleDocTemplate lays pages out in.
+    """
+    from reportlab.platypus import Frame
+
+    frame = Frame(doc.leftMargin, doc.bottomMargin, doc.width, doc.height)
+    width = doc.width - frame.leftPadding - frame.rightPadding
+    height = doc.height - frame.topPadding - frame.bottomPadding
+    sample_row = ["0000-00-00", "Category", "$0.00"]
+    one_row = make_table([sample_row]).wrap(width, height)[1]
+    row = make_table([sample_row] * 2).wrap(width, height)[1] - one_row
+    header = one_row - row
+    heading_height = heading.wrap(width, height)[1] + heading.getSpaceAfter()
+    return int((height - header) // row), int((height - heading_height - header) // row)
+
+
+class _FlowableStream(list):
+    """Flowable list for ``doc.build`` that is refilled from an iterator.
+
+    reportlab consumes flowables with ``del flowables[0]``; each time that
+    happens the list is topped up from ``more``, so generated flowables are
+    only created shortly before they are laid out.
+    """
+
+    def __init__(self, flowables, more):
+        super().__init__(flowables)
+        self._more = iter(more)
+        self._refill()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._refill()
+
+    def _refill(self):
+        while len(self) < 2:
+            flowable = next(self._more, None)
+            if flowable is None:
+                break
+            self.append(flowable)
@@ -0,0 +1,330 @@
+import bisect
+import datetime
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from categories import CategoryRegistry
+from store import ExpenseStore, from_cents, month_key, month_keys
+
+# Snapshot formats for CsvStorage(snapshot=...). Both keep a copy of the
+# expense history that loads without parsing the CSV, record the signature
+# of the files they were taken from, and answer date-range queries by
+# reading only the part of the file that covers the range.
+
+# Rows per Parquet row group. Each group records its min/max date, so a
+# date filter inside a month partition skips the groups outside the range.
+ROW_GROUP_SIZE = 64 * 1024
+
+# Columns stored per expense; year and month are the partition directories.
+SNAPSHOT_COLUMNS = ("id", "date", "category", "cents")
+
+METADATA_FILE = "_snapshot.json"
+
+
+class ParquetSnapshot:
+    """Parquet copy of an expense history, partitioned by year and month.
+
+    The snapshot is a directory of ``year=YYYY/month=M/part-0.parquet``
+    files plus ``_snapshot.json``, which records the signature of the files
+    it was taken from, the next row id and the category names (in code
+    order). Categories are dictionary-encoded with int8 indices and amounts
+    are int64 cents, as in ExpenseStore.
+
+    ``read`` opens only the partitions overlapping the requested dates and
+    pushes the date (and category) filter down to the row groups, so a
+    month's expenses are read without touching the rest of the history.
+    Needs pyarrow (see ``available``), which is imported on first use so
+    that importing this module stays cheap.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._partitioning = None
+
+    SUFFIX = ".parquet"
+
+    @staticmethod
+    def available():
+        return importlib.util.find_spec("pyarrow") is not None
+
+    def metadata(self):
+        """Return the snapshot's metadata dict, or None if there is no snapshot."""
+        try:
+            with open(os.path.join(self.path, METADATA_FILE)) as f:
+                return _parse_metadata(json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def write(self, store, source):
+        """Replace the snapshot with the contents of ``store``.
+
+        ``source`` is the signature of the files ``store`` was read from. The
+        new snapshot is written next to the old one and renamed into place.
+        """
+        pa, ds = _pyarrow()
+        years = store.months // 12 + 1970
+        table = pa.table({
+            "id": store.ids,
+            "date": pa.array(store.dates, type=pa.date32()),
+            "category": pa.DictionaryArray.from_arrays(pa.array(store.codes), pa.array(store.categories)),
+            "cents": store.cents,
+            "year": pa.array(years, type=pa.int16()),
+            "month": pa.array(store.months % 12 + 1, type=pa.int8()),
+        })
+        # Date order inside each partition keeps the row group date ranges tight
+        table = table.sort_by([("date", "ascending"), ("id", "ascending")])
+
+        parent = os.path.dirname(os.path.abspath(self.path))
+        tmp_path = tempfile.mkdtemp(prefix=os.path.basename(self.path) + ".", suffix=".tmp", dir=parent)
+        try:
+            ds.write_dataset(
+                table, tmp_path, format="parquet", partitioning=self._hive(),
+                basename_template="part-{i}.parquet", existing_data_behavior="overwrite_or_ignore",
+                max_rows_per_group=ROW_GROUP_SIZE, min_rows_per_group=min(ROW_GROUP_SIZE, max(1, len(table))),
+            )
+            with open(os.path.join(tmp_path, METADATA_FILE), "w") as f:
+                json.dump({"source": source, "next_id": store.next_id, "categories": store.categories,
+                           "rows": len(store)}, f)
+
+            old_path = None
+            if os.path.exists(self.path):
+                old_path = tmp_path + ".old"
+                os.rename(self.path, old_path)
+            os.rename(tmp_path, self.path)
+            if old_path is not None:
+                shutil.rmtree(old_path, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+    def load(self):
+        """Return the whole snapshot as an ExpenseStore, in date order."""
+        metadata = self.metadata()
+        table = self._dataset(self._partition_files()).to_table(columns=list(SNAPSHOT_COLUMNS))
+        ids = table["id"].to_numpy()
+        dates = table["date"].to_numpy().astype("datetime64[D]")
+        order = np.lexsort((ids, dates))
+        categories = table["category"].to_pandas()
+        store = ExpenseStore.from_columns(
+            ids[order],
+            dates[order],
+            categories.iloc[order],
+            table["cents"].to_numpy()[order],
+            metadata["categories"],
+        )
+        store.next_id = metadata["next_id"]
+        return store
+
+    def read(self, start, end, category=None, columns=SNAPSHOT_COLUMNS):
+        """Return the expenses dated in ``[start, end)`` as a query frame.
+
+        Only the month partitions overlapping the range are opened, and only
+        ``columns`` are read from them. The frame has the columns of
+        ``ExpenseStore.frame()`` that can be derived from ``columns``.
+        """
+        pa, ds = _pyarrow()
+        last = end - datetime.timedelta(days=1)
+        files = self._partition_files(range(month_key(start.year, start.month), month_key(last.year, last.month) + 1))
+        condition = (ds.field("date") >= pa.scalar(start, pa.date32())) & (ds.field("date") < pa.scalar(end, pa.date32()))
+        if category is not None:
+            condition &= ds.field("category") == category
+        if not files:
+            table = pa.table({name: pa.array([], type=self._schema().field(name).type) for name in columns})
+        else:
+            table = self._dataset(files).to_table(columns=list(columns), filter=condition)
+        df = table.to_pandas(date_as_object=False)
+        if "id" in df:
+            df = df.sort_values(["date", "id"] if "date" in df else "id", kind="stable", ignore_index=True)
+        return _query_frame(df)
+
+    def _partition_files(self, months=None):
+        """Return the Parquet files of the given month keys (default: all months)."""
+        if months is None:
+            files = []
+            for directory, _, names in os.walk(self.path):
+                files.extend(os.path.join(directory, name) for name in sorted(names) if name.endswith(".parquet"))
+            return sorted(files)
+        files = []
+        for key in months:
+            directory = os.path.join(self.path, f"year={key // 12 + 1970}", f"month={key % 12 + 1}")
+            if os.path.isdir(directory):
+                files.extend(os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                             if name.endswith(".parquet"))
+        return files
+
+    def _dataset(self, files):
+        _, ds = _pyarrow()
+        return ds.dataset(files, format="parquet", partitioning=self._hive(), partition_base_dir=self.path,
+                          schema=self._schema())
+
+    def _hive(self):
+        if self._partitioning is None:
+            pa, ds = _pyarrow()
+            self._partitioning = ds.partitioning(pa.schema([("year", pa.int16()), ("month", pa.int8())]),
+                                                 flavor="hive")
+        return self._partitioning
+
+    @staticmethod
+    def _schema():
+        pa, _ = _pyarrow()
+        return pa.schema([
+            ("id", pa.int64()),
+            ("date", pa.date32()),
+            ("category", pa.dictionary(pa.int8(), pa.string())),
+            ("cents", pa.int64()),
+            ("year", pa.int16()),
+            ("month", pa.int8()),
+        ])
+
+
+class BinarySnapshot:
+    """Fixed-width binary copy of an expense history, opened with numpy.memmap.
+
+    The file is a small JSON header (the same metadata as ParquetSnapshot)
+    followed by one packed little-endian RECORD per expense, in date order.
+    ``load`` maps the records copy-on-write and hands the id, category code
+    and cents fields to ExpenseStore as zero-copy views; only the dates are
+    widened to ``datetime64[D]``. Pages are read from the file as they are
+    touched, so they stay shared page cache rather than process memory until
+    the store changes them.
+
+    ``read`` binary-searches the memory-mapped day field for ``[start, end)``
+    and copies out just that slice.
+    """
+
+    SUFFIX = ".bin"
+    MAGIC = b"EXPREC1\n"
+    # Records start at a multiple of this many bytes into the file
+    ALIGN = 64
+    RECORD = np.dtype([("day", "<i4"), ("category", "i1"), ("cents", "<i8"), ("id", "<i8")])
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def available():
+        return True
+
+    def metadata(self):
+        """Return the snapshot's metadata dict, or None if there is no snapshot."""
+        header = self._header()
+        return None if header is None else header[0]
+
+    def write(self, store, source):
+        """Replace the snapshot with the contents of ``store``.
+
+        ``source`` is the signature of the files ``store`` was read from. The
+        file is written to a temporary name and renamed into place.
+        """
+        order = np.lexsort((store.ids, store.dates))
+        records = np.empty(len(store), dtype=self.RECORD)
+        records["day"] = store.dates.astype(np.int64)[order]
+        records["category"] = store.codes[order]
+        records["cents"] = store.cents[order]
+        records["id"] = store.ids[order]
+
+        header = json.dumps({"source": source, "next_id": store.next_id, "categories": store.categories,
+                             "rows": len(store)}).encode()
+        prefix = self.MAGIC + len(header).to_bytes(8, "little") + header
+        prefix += b" " * (-len(prefix) % self.ALIGN)
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(prefix)
+                f.write(records.data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def load(self):
+        """Return the snapshot as an ExpenseStore backed by the mapped records."""
+        metadata, records = self._records()
+        store = ExpenseStore.from_codes(
+            records["id"], records["day"].astype("datetime64[D]"), records["category"], records["cents"],
+            metadata["categories"],
+        )
+        store.next_id = metadata["next_id"]
+        return store
+
+    def read(self, start, end, category=None):
+        """Return the expenses dated in ``[start, end)`` as a query frame, in date order."""
+        metadata, records = self._records()
+        days = records["day"]
+        # bisect on the strided view touches O(log n) pages; np.searchsorted
+        # would first copy the whole field into a contiguous array
+        lo = bisect.bisect_left(days, _day_number(start))
+        hi = bisect.bisect_left(days, _day_number(end), lo)
+        part = records[lo:hi]
+        if category is not None:
+            code = CategoryRegistry(metadata["categories"]).code(category)
+            part = part[:0] if code is None else part[part["category"] == code]
+        return _query_frame(pd.DataFrame({
+            "id": part["id"],
+            "date": part["day"].astype("datetime64[D]"),
+            "category": pd.Categorical.from_codes(part["category"], categories=metadata["categories"]),
+            "cents": part["cents"],
+        }))
+
+    def _header(self):
+        """Return ``(metadata, records offset)``, or None if there is no snapshot."""
+        try:
+            with open(self.path, "rb") as f:
+                if f.read(len(self.MAGIC)) != self.MAGIC:
+                    return None
+                length = int.from_bytes(f.read(8), "little")
+                metadata = json.loads(f.read(length))
+        except FileNotFoundError:
+            return None
+        offset = len(self.MAGIC) + 8 + length
+        return _parse_metadata(metadata), offset + (-offset % self.ALIGN)
+
+    def _records(self):
+        metadata, offset = self._header()
+        if not metadata["rows"]:
+            return metadata, np.empty(0, dtype=self.RECORD)
+        return metadata, np.memmap(self.path, dtype=self.RECORD, mode="c", offset=offset,
+                                   shape=(metadata["rows"],))
+
+
+SNAPSHOT_FORMATS = {"parquet": ParquetSnapshot, "binary": BinarySnapshot}
+
+
+def _pyarrow():
+    """Return ``(pyarrow, pyarrow.dataset)``, imported on first use."""
+    import pyarrow
+    import pyarrow.dataset
+
+    return pyarrow, pyarrow.dataset
+
+
+def _parse_metadata(metadata):
+    # JSON turns the signature tuples into lists
+    metadata["source"] = tuple(tuple(sig) if sig is not None else None for sig in metadata["source"])
+    return metadata
+
+
+def _day_number(date):
+    return int(np.datetime64(date, "D").astype(np.int64))
+
+
+def _query_frame(df):
+    """Rename snapshot columns to the Id / Date / MonthKey / Category / Amount / Cents frame."""
+    df = df.rename(columns={"id": "Id", "date": "Date", "category": "Category", "cents": "Cents"})
+    if "Date" in df:
+        df["Date"] = df["Date"].astype("datetime64[s]")
+        df.insert(df.columns.get_loc("Date") + 1, "MonthKey", month_keys(df["Date"].to_numpy(dtype="datetime64[D]")))
+    if "Cents" in df:
+        df.insert(df.columns.get_loc("Cents"), "Amount", from_cents(df["Cents"]))
+    return df
@@ -0,0 +1,977 @@
+import csv
+import datetime
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+import pandas as pd
+
+import timing
+from budget import Budget
+from categories import DEFAULT_CATEGORIES, CategoryRegistry
+from snapshot import SNAPSHOT_FORMATS
+from store import ExpenseStore, format_cents, frame_span, from_cents, month_keys, to_cents
+
+COLUMNS = ["Date", "Category", "Amount"]
+JOURNAL_COLUMNS = ["Op", "Row", "Date", "Category", "Amount"]
+
+# Number of journalled edits/deletes after which they are folded back into
+# the main CSV file, by the edit that reaches it or the next load.
+COMPACT_THRESHOLD = 500
+
+# Bytes appended to the CSV and journal since the snapshot was taken
+# after which the next full load writes a fresh snapshot.
+SNAPSHOT_REFRESH_BYTES = 64 * 1024
+
+# Directory holding one sub-directory of data files per user; see
+# open_user_storage.
+SHARD_ROOT = os.environ.get("EXPENSE_SHARD_ROOT", "users")
+
+# Parsed files shared by every session in this process. Streamlit re-runs
+# app.py on each interaction but keeps imported modules, so entries survive
+# reruns. Each entry is keyed by file path and remembers the (inode, mtime,
+# size) of the files it was parsed from.
+_cache = {}
+_cache_lock = threading.Lock()
+CACHE_STATS = {"hits": 0, "misses": 0}
+
+
+def _file_signature(paths):
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            # The inode tells an atomic replace apart from an append
+            signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def cached_load(key, paths, loader):
+    """Return the cached value for ``key`` or call ``loader`` to build it.
+
+    The cached value is reused as long as none of ``paths`` changed on disk.
+    """
+    signature = _file_signature(paths)
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == signature:
+            CACHE_STATS["hits"] += 1
+            return entry[1]
+        CACHE_STATS["misses"] += 1
+
+    value = loader()
+    with _cache_lock:
+        # The loader may have rewritten the files (compaction), so take the
+        # signature again.
+        _cache[key] = (_file_signature(paths), value)
+    return value
+
+
+def refresh_cache(key, paths, value):
+    """Record ``value`` as current after writing ``paths`` ourselves."""
+    with _cache_lock:
+        _cache[key] = (_file_signature(paths), value)
+
+
+def cached_entry(key):
+    """Return ``(signature, value)`` for ``key``, or None if nothing is cached."""
+    with _cache_lock:
+        return _cache.get(key)
+
+
+def invalidate_cache(key=None):
+    with _cache_lock:
+        if key is None:
+            _cache.clear()
+        else:
+            _cache.pop(key, None)
+
+
+def cache_stats():
+    with _cache_lock:
+        return dict(CACHE_STATS, entries=len(_cache))
+
+
+# Writers (and readers, so they never see a compaction half done) hold an
+# advisory lock on ``<data file>.lock``. LOCK_STATS accumulates how long
+# callers waited for it and how long it was held, to show contention.
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+_lock_stats_lock = threading.Lock()
+LOCK_STATS = {"acquired": 0, "wait_seconds": 0.0, "held_seconds": 0.0, "max_held_seconds": 0.0}
+
+
+class FileLock:
+    """Exclusive advisory lock on a file, re-entrant within a thread.
+
+    A threading.RLock serialises the threads of this process; the first
+    acquisition in a thread also takes an OS-level lock on the file, which
+    serialises other processes. Use ``file_lock(path)`` to get the shared
+    instance for a path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._file = None
+        self._acquired_at = None
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self._rlock.acquire()
+        if self._depth == 0:
+            try:
+                self._file = open(self.path, "a+b")
+                _lock_file(self._file)
+            except BaseException:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._rlock.release()
+                raise
+            self._acquired_at = time.perf_counter()
+            with _lock_stats_lock:
+                LOCK_STATS["acquired"] += 1
+                LOCK_STATS["wait_seconds"] += self._acquired_at - start
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            held = time.perf_counter() - self._acquired_at
+            _unlock_file(self._file)
+            self._file.close()
+            self._file = None
+            with _lock_stats_lock:
+                LOCK_STATS["held_seconds"] += held
+                LOCK_STATS["max_held_seconds"] = max(LOCK_STATS["max_held_seconds"], held)
+        self._rlock.release()
+
+
+def file_lock(path):
+    """Return the process-wide FileLock guarding data file ``path``."""
+    lock_path = os.path.abspath(path) + ".lock"
+    with _file_locks_guard:
+        lock = _file_locks.get(lock_path)
+        if lock is None:
+            lock = _file_locks[lock_path] = FileLock(lock_path)
+        return lock
+
+
+def lock_stats():
+    with _lock_stats_lock:
+        return dict(LOCK_STATS)
+
+
+if fcntl is not None:
+    def _lock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+else:
+    def _lock_file(f):
+        f.seek(0)
+        # LK_LOCK gives up after ~10 seconds; keep waiting
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+
+    def _unlock_file(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def replace_file(path, write):
+    """Atomically replace ``path`` with what ``write(f)`` writes to a text file.
+
+    The data goes to a temporary file in the same directory which is then
+    renamed over ``path``, so readers see either the old or the new file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", newline="") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class CsvStorage:
+    """Append-only CSV storage for expenses, plus the budget and category CSVs.
+
+    New expenses are appended as a single row to ``expenses.csv``. Edits and
+    deletes are written to a small journal next to it and refer to rows by
+    their position in the CSV file, which stays stable until the journal is
+    compacted. Compaction rewrites the CSV without the deleted rows and
+    empties the journal. Amounts are written as exact ``D.CC`` text from
+    integer cents (``format_cents``) and read back into cents. User-defined
+    categories are listed in ``categories.csv`` next to the expenses.
+
+    With ``snapshot="parquet"`` (``ParquetSnapshot``, ``expenses.parquet``)
+    or ``snapshot="binary"`` (``BinarySnapshot``, memory-mapped
+    ``expenses.bin``) a copy of the history is kept next to the CSV. It is
+    written after a full parse or a compaction; later loads read it and
+    merge only the rows and journal entries appended since, and date-range
+    queries made before anything is loaded read just the part of the
+    snapshot they cover.
+
+    Parsed data is kept in the process-wide cache. Writes made through this
+    class update the loaded ExpenseStore / Budget in place and refresh
+    the cache entry, so the next rerun does not parse the files again.
+
+    Every read and write holds ``file_lock`` on the data file, and whole-file
+    rewrites go through ``replace_file``. Before writing, the loaded data is
+    checked against the files: rows and journal entries that another process
+    appended meanwhile are merged in rather than overwritten, and anything
+    else (e.g. a compaction elsewhere) triggers a full reload.
+    """
+
+    def __init__(self, filepath="expenses.csv", budget_file="budget.csv", categories_file=None, snapshot=None):
+        self.filepath = filepath
+        self.journal_path = filepath + ".journal"
+        self.budget_file = budget_file
+        if categories_file is None:
+            categories_file = os.path.join(os.path.dirname(filepath), "categories.csv")
+        self.categories_file = categories_file
+        self.snapshot = None
+        if snapshot:
+            snapshot_class = SNAPSHOT_FORMATS.get(snapshot)
+            if snapshot_class is None:
+                raise ValueError(f"Unknown snapshot format: {snapshot}")
+            if not snapshot_class.available():
+                raise ValueError(f"{snapshot} snapshots need pyarrow (pip install pyarrow)")
+            self.snapshot = snapshot_class(os.path.splitext(filepath)[0] + snapshot_class.SUFFIX)
+        self.expenses = None
+        self.budget = None
+
+    @property
+    def _expenses_key(self):
+        return ("expenses", os.path.abspath(self.filepath))
+
+    @property
+    def _budget_key(self):
+        return ("budget", os.path.abspath(self.budget_file))
+
+    @property
+    def _categories_key(self):
+        return ("categories", os.path.abspath(self.categories_file))
+
+    def load_expenses(self):
+        """Return the ExpenseStore of live expenses, parsing only if needed."""
+        with file_lock(self.filepath):
+            self.expenses = cached_load(
+                self._expenses_key, [self.filepath, self.journal_path], self._read_expenses
+            )
+        return self.expenses
+
+    def add_expense(self, date, category, amount):
+        """Append one expense (``amount`` in dollars) to the CSV and return its row id."""
+        cents = to_cents(amount)
+        with file_lock(self.filepath):
+            store = self._current_expenses()
+            category = store.registry.add(category)
+            row = [date.strftime('%Y-%m-%d'), category, format_cents(cents)]
+            with open(self.filepath, "a+b") as f:
+                if f.tell() == 0:
+                    f.write((",".join(COLUMNS) + "\n").encode())
+                else:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                f.write(_format_row(row).encode())
+
+            row_id = store.next_id
+            store.append(row_id, date, category, cents)
+            self._refresh_expenses()
+        return row_id
+
+    def add_expenses(self, rows):
+        """Append a DataFrame of Date / Category / Amount (dollars) rows in one write.
+
+        Raises ValueError, writing nothing, if the rows' categories would not
+        fit in the category registry.
+        """
+        cents = to_cents(rows["Amount"])
+        data = rows[["Date", "Category"]].assign(Amount=format_cents(cents)).to_csv(
+            header=False, index=False, date_format="%Y-%m-%d", lineterminator="\n"
+        )
+        with file_lock(self.filepath):
+            store = self._current_expenses()
+            _check_categories(store, rows["Category"])
+            with open(self.filepath, "a+b") as f:
+                if f.tell() == 0:
+                    f.write((",".join(COLUMNS) + "\n").encode())
+                else:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                f.write(data.encode())
+
+            ids = np.arange(store.next_id, store.next_id + len(rows))
+            store.extend(ids, rows["Date"], rows["Category"], cents)
+            self._refresh_expenses()
+
+    def update_expense(self, row_id, date, category, amount):
+        cents = to_cents(amount)
+        with file_lock(self.filepath):
+            store = self._current_expenses()
+            category = store.registry.add(category)
+            if not store.update(row_id, date, category, cents):
+                return False
+            self._append_journal(["update", row_id, date.strftime('%Y-%m-%d'), category, format_cents(cents)])
+            self._refresh_expenses()
+            self._compact_if_due(store)
+        return True
+
+    def delete_expense(self, row_id):
+        with file_lock(self.filepath):
+            store = self._current_expenses()
+            if not store.delete(row_id):
+                return False
+            self._append_journal(["delete", row_id, "", "", ""])
+            self._refresh_expenses()
+            self._compact_if_due(store)
+        return True
+
+    def compact(self, store=None):
+        """Rewrite the CSV from ``store``, drop the journal and renumber rows."""
+        with file_lock(self.filepath):
+            if store is None or store is self.expenses:
+                store = self._current_expenses()
+            df = store.frame()[["Date", "Category"]].assign(Amount=format_cents(store.cents))
+            replace_file(self.filepath, lambda f: df.to_csv(f, index=False, date_format="%Y-%m-%d"))
+            store.renumber()
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            if self.snapshot is not None:
+                self.snapshot.write(store, _file_signature([self.filepath, self.journal_path]))
+            if store is self.expenses:
+                self._refresh_expenses()
+
+    @timing.timed_function("storage.query")
+    def query_expenses(self, start, end, category=None):
+        """Return expenses dated in ``[start, end)``, optionally for one category.
+
+        ``category`` is matched like CategoryRegistry.lookup (case-insensitively).
+        """
+        if self.snapshot is not None and cached_entry(self._expenses_key) is None:
+            # Nothing loaded yet: read only the months asked for, if the
+            # snapshot is up to date
+            with file_lock(self.filepath):
+                metadata = self.snapshot.metadata()
+                if metadata is not None and metadata["source"] == _file_signature([self.filepath, self.journal_path]):
+                    if category is not None:
+                        category = CategoryRegistry(metadata["categories"]).lookup(category) or category
+                    return self.snapshot.read(start, end, category)
+        # The store is in date order, so the range is one slice of the frame
+        store = self.load_expenses()
+        df = store.frame()
+        first, stop = frame_span(df, start, end)
+        df = df.iloc[first:stop]
+        if category is not None:
+            df = df[df["Category"] == (store.registry.lookup(category) or category)]
+        return df
+
+    def load_categories(self):
+        """Return the expenses' CategoryRegistry, including every saved user category."""
+        store = self.load_expenses()
+        with file_lock(self.categories_file):
+            saved = cached_load(self._categories_key, [self.categories_file], self._read_categories)
+        store.add_categories(saved)
+        return store.registry
+
+    def add_category(self, name):
+        """Register and save a user-defined category; returns its registered spelling.
+
+        Raises ValueError for an empty name or when there are too many categories.
+        """
+        store = self.load_expenses()
+        with file_lock(self.categories_file):
+            saved = self._read_categories()
+            store.add_categories([name])
+            name = store.registry.lookup(name)
+            if name not in CategoryRegistry(DEFAULT_CATEGORIES + tuple(saved)):
+                saved.append(name)
+                replace_file(
+                    self.categories_file, lambda f: pd.DataFrame({"Category": saved}).to_csv(f, index=False)
+                )
+            refresh_cache(self._categories_key, [self.categories_file], saved)
+        return name
+
+    def load_budget(self):
+        with file_lock(self.budget_file):
+            self.budget = cached_load(self._budget_key, [self.budget_file], self._read_budget)
+        return self.budget
+
+    def save_budget(self, budget):
+        """Save the budgets changed in ``budget`` since it was loaded or last saved.
+
+        If the file changed since ``budget`` was read, it is re-read and only
+        this session's changes are applied on top, so budgets another process
+        saved meanwhile are kept.
+        """
+        with file_lock(self.budget_file):
+            entry = cached_entry(self._budget_key)
+            if entry is None or entry[1] is not budget or entry[0] != _file_signature([self.budget_file]):
+                budget.rebase(self._read_budget())
+
+            # Keeps the flat "YYYY-MM-Category" key format for older readers
+            df = pd.DataFrame.from_dict(budget.to_flat(), orient='index', columns=["Budget"])
+            replace_file(self.budget_file, df.to_csv)
+            budget.mark_saved()
+            self.budget = budget
+            refresh_cache(self._budget_key, [self.budget_file], budget)
+
+    def _read_expenses(self):
+        known_categories = DEFAULT_CATEGORIES + tuple(self._read_categories())
+        if not os.path.exists(self.filepath):
+            return ExpenseStore(known_categories)
+        if self.snapshot is not None:
+            store = self._read_snapshot()
+            if store is not None:
+                store.add_categories(known_categories)
+                return store
+
+        df = pd.read_csv(self.filepath)
+        dates = pd.to_datetime(df["Date"], format="%Y-%m-%d").to_numpy(dtype="datetime64[D]")
+        categories = df["Category"].to_numpy(dtype=object)
+        cents = to_cents(df["Amount"])
+
+        journal = self._read_journal()
+        live = np.ones(len(df), dtype=bool)
+        for op, row_id, date, category, amount in journal:
+            if op == "update":
+                dates[row_id] = np.datetime64(date, "D")
+                categories[row_id] = category
+                cents[row_id] = amount
+            elif op == "delete":
+                live[row_id] = False
+
+        store = ExpenseStore.from_columns(
+            np.flatnonzero(live), dates[live], categories[live], cents[live], known_categories
+        )
+        # Appended rows get the next line of the file, deleted ones included.
+        store.next_id = len(df)
+        if len(journal) >= COMPACT_THRESHOLD:
+            self.compact(store)
+        elif self.snapshot is not None:
+            self.snapshot.write(store, _file_signature([self.filepath, self.journal_path]))
+        return store
+
+    def _read_snapshot(self):
+        """Return the store from the snapshot plus later appends, or None if stale."""
+        metadata = self.snapshot.metadata()
+        if metadata is None:
+            return None
+        known = metadata["source"]
+        current = _file_signature([self.filepath, self.journal_path])
+        if not all(_grown_from(k, c) for k, c in zip(known, current)):
+            return None
+        store = self.snapshot.load()
+        if not self._merge_appends(store, known, current):
+            return None
+        appended = sum(c[2] - (k[2] if k else 0) for k, c in zip(known, current) if c is not None)
+        if appended > SNAPSHOT_REFRESH_BYTES:
+            if self._journal_length() >= COMPACT_THRESHOLD:
+                self.compact(store)
+            else:
+                self.snapshot.write(store, current)
+        return store
+
+    def _read_categories(self):
+        if os.path.exists(self.categories_file):
+            return pd.read_csv(self.categories_file, dtype=str)["Category"].dropna().tolist()
+        return []
+
+    def _read_budget(self):
+        if os.path.exists(self.budget_file):
+            flat = pd.read_csv(self.budget_file, index_col=0).to_dict()["Budget"]
+            return Budget.from_flat({str(key): value for key, value in flat.items()})
+        return Budget()
+
+    def _refresh_expenses(self):
+        refresh_cache(self._expenses_key, [self.filepath, self.journal_path], self.expenses)
+
+    def _current_expenses(self):
+        """Return the loaded store, brought up to date with the files.
+
+        Called with the lock held, before a write. Appends made by other
+        processes since the store was loaded are merged into it; if the files
+        changed in any other way the store is reloaded.
+        """
+        entry = cached_entry(self._expenses_key)
+        if entry is None:
+            return self.load_expenses()
+        known, store = entry
+        self.expenses = store
+        current = _file_signature([self.filepath, self.journal_path])
+        if current == known:
+            return store
+        if self._merge_appends(store, known, current):
+            self._refresh_expenses()
+            return store
+        invalidate_cache(self._expenses_key)
+        return self.load_expenses()
+
+    def _merge_appends(self, store, known, current):
+        """Apply rows and journal entries appended since ``known``; False if impossible."""
+        (known_csv, known_journal), (current_csv, current_journal) = known, current
+        if not _grown_from(known_csv, current_csv) or not _grown_from(known_journal, current_journal):
+            return False
+
+        if current_csv is not None and current_csv != known_csv:
+            offset = known_csv[2] if known_csv is not None else 0
+            with open(self.filepath, "rb") as f:
+                f.seek(offset)
+                tail = f.read()
+            if tail.strip():
+                # A file that did not exist before starts with its header
+                df = pd.read_csv(
+                    io.BytesIO(tail), header=None if offset else 0, names=COLUMNS,
+                    parse_dates=["Date"], date_format="%Y-%m-%d",
+                )
+                for date, category, cents in zip(df["Date"].dt.date, df["Category"], to_cents(df["Amount"])):
+                    store.append(store.next_id, date, category, int(cents))
+
+        if current_journal is not None and current_journal != known_journal:
+            offset = known_journal[2] if known_journal is not None else 0
+            for op, row_id, date, category, amount in self._read_journal(offset):
+                if op == "update":
+                    store.update(row_id, datetime.date.fromisoformat(date), category, amount)
+                elif op == "delete":
+                    store.delete(row_id)
+        return True
+
+    def _append_journal(self, entry):
+        with open(self.journal_path, "a", newline="") as f:
+            if f.tell() == 0:
+                f.write(",".join(JOURNAL_COLUMNS) + "\n")
+            f.write(_format_row(entry))
+
+    def _compact_if_due(self, store):
+        # Loads are cache hits while this process keeps writing, so the
+        # threshold is checked here too
+        if self._journal_length() >= COMPACT_THRESHOLD:
+            self.compact(store)
+
+    def _journal_length(self):
+        """Return the number of journal entries."""
+        if not os.path.exists(self.journal_path):
+            return 0
+        with open(self.journal_path, "rb") as f:
+            # One line per entry after the header
+            return max(0, f.read().count(b"\n") - 1)
+
+    def _read_journal(self, offset=0):
+        """Return the journal entries, or only those written after byte ``offset``.
+
+        Entries are ``(op, row, date, category, cents)``.
+        """
+        if not os.path.exists(self.journal_path):
+            return []
+        with open(self.journal_path, "rb") as f:
+            f.seek(offset)
+            lines = f.read().decode().splitlines()
+        reader = csv.reader(lines)
+        if not offset:
+            next(reader, None)
+        entries = []
+        for op, row_id, date, category, amount in reader:
+            entries.append((op, int(row_id), date, category, to_cents(amount) if amount else None))
+        return entries
+
+
+class SQLiteStorage:
+    """Expenses and budgets in a SQLite database.
+
+    Expenses are indexed on ``date`` and ``(category, date)`` so the month
+    and category slices used by the budget and report screens are index
+    range scans. Budgets live in their own table keyed by
+    ``(month, category)``; an empty category is a budget for the whole month.
+    User-defined categories are kept in the ``categories`` table.
+    Dates are stored as ISO ``YYYY-MM-DD`` text, which sorts chronologically,
+    and amounts as INTEGER cents.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS expenses (
+            id INTEGER PRIMARY KEY,
+            date TEXT NOT NULL,
+            category TEXT NOT NULL,
+            cents INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses (date);
+        CREATE INDEX IF NOT EXISTS idx_expenses_category_date ON expenses (category, date);
+        CREATE TABLE IF NOT EXISTS budgets (
+            month TEXT NOT NULL,
+            category TEXT NOT NULL DEFAULT '',
+            amount REAL NOT NULL,
+            PRIMARY KEY (month, category)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS categories (
+            name TEXT PRIMARY KEY
+        );
+        PRAGMA user_version = 2;
+    """
+
+    # Version 1 databases kept expense amounts as REAL dollars.
+    MIGRATE_CENTS = """
+        BEGIN;
+        ALTER TABLE expenses ADD COLUMN cents INTEGER NOT NULL DEFAULT 0;
+        UPDATE expenses SET cents = CAST(ROUND(amount * 100) AS INTEGER);
+        ALTER TABLE expenses DROP COLUMN amount;
+        PRAGMA user_version = 2;
+        COMMIT;
+    """
+
+    def __init__(self, db_path="expenses.db"):
+        self.db_path = db_path
+        self.expenses = None
+        self.budget = None
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            with file_lock(self.db_path):
+                conn = sqlite3.connect(self.db_path)
+                if conn.execute("PRAGMA user_version").fetchone()[0] == 1:
+                    conn.executescript(self.MIGRATE_CENTS)
+                conn.executescript(self.SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    @property
+    def _expenses_key(self):
+        return ("sqlite-expenses", os.path.abspath(self.db_path))
+
+    @property
+    def _budget_key(self):
+        return ("sqlite-budget", os.path.abspath(self.db_path))
+
+    @property
+    def _categories_key(self):
+        return ("sqlite-categories", os.path.abspath(self.db_path))
+
+    def load_expenses(self):
+        self.expenses = cached_load(self._expenses_key, [self.db_path], self._read_expenses)
+        return self.expenses
+
+    def add_expense(self, date, category, amount):
+        cents = to_cents(amount)
+        with file_lock(self.db_path):
+            store = self._current_expenses()
+            category = store.registry.add(category)
+            with self.conn:
+                cursor = self.conn.execute(
+                    "INSERT INTO expenses (date, category, cents) VALUES (?, ?, ?)",
+                    (date.strftime('%Y-%m-%d'), category, cents),
+                )
+            row_id = cursor.lastrowid
+            store.append(row_id, date, category, cents)
+            self._refresh_expenses()
+        return row_id
+
+    def add_expenses(self, rows):
+        """Insert a DataFrame of Date / Category / Amount (dollars) rows in one transaction.
+
+        Raises ValueError, inserting nothing, if the rows' categories would
+        not fit in the category registry.
+        """
+        cents = to_cents(rows["Amount"])
+        values = zip(rows["Date"].dt.strftime('%Y-%m-%d'), rows["Category"].astype(str), cents.tolist())
+        with file_lock(self.db_path):
+            store = self._current_expenses()
+            _check_categories(store, rows["Category"])
+            with self.conn:
+                last_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM expenses").fetchone()[0]
+                self.conn.executemany("INSERT INTO expenses (date, category, cents) VALUES (?, ?, ?)", values)
+                ids = [row[0] for row in self.conn.execute(
+                    "SELECT id FROM expenses WHERE id > ? ORDER BY id", (last_id,)
+                )]
+            store.extend(ids, rows["Date"], rows["Category"], cents)
+            self._refresh_expenses()
+
+    def update_expense(self, row_id, date, category, amount):
+        cents = to_cents(amount)
+        with file_lock(self.db_path):
+            store = self._current_expenses()
+            category = store.registry.add(category)
+            with self.conn:
+                cursor = self.conn.execute(
+                    "UPDATE expenses SET date = ?, category = ?, cents = ? WHERE id = ?",
+                    (date.strftime('%Y-%m-%d'), category, cents, row_id),
+                )
+            if not cursor.rowcount:
+                return False
+            store.update(row_id, date, category, cents)
+            self._refresh_expenses()
+        return True
+
+    def delete_expense(self, row_id):
+        with file_lock(self.db_path):
+            store = self._current_expenses()
+            with self.conn:
+                cursor = self.conn.execute("DELETE FROM expenses WHERE id = ?", (row_id,))
+            if not cursor.rowcount:
+                return False
+            store.delete(row_id)
+            self._refresh_expenses()
+        return True
+
+    def compact(self, store=None):
+        # Rows are updated in place, there is no journal to fold back.
+        self.conn.execute("VACUUM")
+
+    @timing.timed_function("storage.query")
+    def query_expenses(self, start, end, category=None):
+        """Return expenses dated in ``[start, end)``, optionally for one category.
+
+        ``category`` is matched like CategoryRegistry.lookup (case-insensitively).
+        """
+        sql = "SELECT id, date, category, cents FROM expenses WHERE date >= ? AND date < ?"
+        params = [start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')]
+        if category is not None:
+            sql += " AND category = ?"
+            # Resolve the spelling from the categories table alone; the
+            # expense store (load_categories) is a full table read
+            registry = CategoryRegistry(DEFAULT_CATEGORIES + tuple(self._read_categories()))
+            params.append(registry.lookup(category) or category)
+        rows = self.conn.execute(sql + " ORDER BY date, id", params).fetchall()
+        return _frame_from_rows(rows)
+
+    def load_categories(self):
+        """Return the expenses' CategoryRegistry, including every saved user category."""
+        store = self.load_expenses()
+        store.add_categories(cached_load(self._categories_key, [self.db_path], self._read_categories))
+        return store.registry
+
+    def add_category(self, name):
+        """Register and save a user-defined category; returns its registered spelling.
+
+        Raises ValueError for an empty name or when there are too many categories.
+        """
+        with file_lock(self.db_path):
+            store = self._current_expenses()
+            store.add_categories([name])
+            name = store.registry.lookup(name)
+            if name not in CategoryRegistry(DEFAULT_CATEGORIES):
+                with self.conn:
+                    self.conn.execute("INSERT OR IGNORE INTO categories (name) VALUES (?)", (name,))
+            self._refresh_expenses()
+            refresh_cache(self._categories_key, [self.db_path], self._read_categories())
+        return name
+
+    def load_budget(self):
+        self.budget = cached_load(self._budget_key, [self.db_path], self._read_budget)
+        return self.budget
+
+    def save_budget(self, budget):
+        """Save the budgets changed in ``budget`` since it was loaded or last saved.
+
+        Only the changed rows are written; budgets another process saved
+        meanwhile are kept, and read back into ``budget``.
+        """
+        with file_lock(self.db_path):
+            entry = cached_entry(self._budget_key)
+            if entry is None or entry[1] is not budget or entry[0] != _file_signature([self.db_path]):
+                budget.rebase(self._read_budget())
+                self._current_expenses()
+
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO budgets (month, category, amount) VALUES (?, ?, ?)", budget.changes()
+                )
+            budget.mark_saved()
+            self.budget = budget
+            refresh_cache(self._budget_key, [self.db_path], budget)
+            # Both cache entries are validated against the same file.
+            if self.expenses is not None:
+                self._refresh_expenses()
+
+    def _read_expenses(self):
+        rows = self.conn.execute("SELECT id, date, category, cents FROM expenses ORDER BY date, id").fetchall()
+        df = _frame_from_rows(rows)
+        return ExpenseStore.from_columns(
+            df["Id"], df["Date"], df["Category"], df["Cents"], DEFAULT_CATEGORIES + tuple(self._read_categories())
+        )
+
+    def _read_categories(self):
+        return [name for name, in self.conn.execute("SELECT name FROM categories ORDER BY rowid")]
+
+    def _read_budget(self):
+        budget = Budget()
+        for month, category, amount in self.conn.execute("SELECT month, category, amount FROM budgets"):
+            if category:
+                budget.set(month, category, amount)
+            else:
+                budget.set_month_limit(month, amount)
+        budget.mark_saved()
+        return budget
+
+    def _refresh_expenses(self):
+        refresh_cache(self._expenses_key, [self.db_path], self.expenses)
+        if self.budget is not None:
+            refresh_cache(self._budget_key, [self.db_path], self.budget)
+
+    def _current_expenses(self):
+        """Return the loaded store, reloaded if another process wrote the database.
+
+        Called with the lock held, before a write. SQLite itself keeps the
+        database consistent; this keeps the cached copies from overwriting
+        what the other writer added when they are refreshed.
+        """
+        entry = cached_entry(self._expenses_key)
+        if entry is not None and entry[0] == _file_signature([self.db_path]):
+            self.expenses = entry[1]
+            return self.expenses
+        invalidate_cache(self._expenses_key)
+        invalidate_cache(self._budget_key)
+        self.budget = None
+        return self.load_expenses()
+
+
+def migrate_csv_to_sqlite(filepath="expenses.csv", budget_file="budget.csv", db_path="expenses.db"):
+    """Copy the CSV expense history and budgets into a new SQLite database.
+
+    Returns the number of expenses copied. Refuses to touch an existing
+    database so it cannot import the same history twice.
+    """
+    if os.path.exists(db_path):
+        raise FileExistsError(f"{db_path} already exists")
+
+    csv_storage = CsvStorage(filepath, budget_file)
+    df = csv_storage.load_expenses().frame()
+    budget = csv_storage.load_budget()
+    # Every budget is new to the database
+    budget.mark_unsaved()
+
+    sqlite_storage = SQLiteStorage(db_path)
+    with sqlite_storage.conn:
+        sqlite_storage.conn.executemany(
+            "INSERT INTO expenses (date, category, cents) VALUES (?, ?, ?)",
+            zip(df["Date"].dt.strftime('%Y-%m-%d'), df["Category"].astype(str), df["Cents"].tolist()),
+        )
+    sqlite_storage.save_budget(budget)
+    for name in csv_storage._read_categories():
+        sqlite_storage.add_category(name)
+    sqlite_storage.conn.close()
+    return len(df)
+
+
+def open_storage(filepath="expenses.csv", budget_file="budget.csv", db_path=None):
+    """Return the storage backend selected by the ``EXPENSE_STORAGE`` env var.
+
+    ``csv`` (the default) uses the CSV files directly. ``sqlite`` uses the
+    database at ``db_path`` (default: ``EXPENSE_DB`` or ``expenses.db``),
+    migrating the CSV files into it the first time. For CSV storage,
+    ``EXPENSE_SNAPSHOT`` (``parquet``, which needs pyarrow, or ``binary``)
+    also keeps a snapshot of the history.
+    """
+    backend = os.environ.get("EXPENSE_STORAGE", "csv").lower()
+    if backend == "sqlite":
+        if db_path is None:
+            db_path = os.environ.get("EXPENSE_DB", "expenses.db")
+        if not os.path.exists(db_path) and (os.path.exists(filepath) or os.path.exists(budget_file)):
+            migrate_csv_to_sqlite(filepath, budget_file, db_path)
+        return SQLiteStorage(db_path)
+    if backend != "csv":
+        raise ValueError(f"Unknown EXPENSE_STORAGE backend: {backend}")
+    return CsvStorage(filepath, budget_file, snapshot=os.environ.get("EXPENSE_SNAPSHOT", "").lower() or None)
+
+
+def open_user_storage(user=None):
+    """Return the storage for ``user``'s shard, or the shared files for None.
+
+    Each user gets their own directory under ``SHARD_ROOT`` holding the same
+    files as the shared setup (``expenses.csv``, ``budget.csv`` or
+    ``expenses.db``). Shards are separate files, so they are cached, loaded
+    and written independently: a user only ever loads their own data.
+    """
+    if user is None:
+        return open_storage()
+    directory = os.path.join(SHARD_ROOT, shard_name(user))
+    # Shards used to be named from the email as typed, so "Alice@x.com"
+    # had its own shard; move it to the shared name if that is still free
+    legacy = os.path.join(SHARD_ROOT, _shard_name(user, user))
+    if legacy != directory and os.path.isdir(legacy) and not os.path.exists(directory):
+        try:
+            os.rename(legacy, directory)
+        except OSError:  # another process moved it first
+            pass
+    os.makedirs(directory, exist_ok=True)
+    return open_storage(
+        os.path.join(directory, "expenses.csv"),
+        os.path.join(directory, "budget.csv"),
+        db_path=os.path.join(directory, "expenses.db"),
+    )
+
+
+def shard_name(user):
+    """Return a directory name for ``user``: readable, but unique per user.
+
+    Emails are compared case-insensitively, so ``Alice@x.com`` and
+    ``alice@x.com`` share a shard.
+    """
+    return _shard_name(user, user.strip().lower())
+
+
+def _shard_name(user, hashed):
+    slug = re.sub(r"[^a-z0-9_.-]+", "_", user.lower()).strip("._")[:40]
+    digest = hashlib.sha256(hashed.encode("utf-8")).hexdigest()[:12]
+    return f"{slug}-{digest}" if slug else digest
+
+
+def _check_categories(store, names):
+    """Raise ValueError, before anything is written, if ``names`` would overflow the store's registry."""
+    registry = CategoryRegistry(store.categories)
+    for name in pd.unique(pd.Series(names, dtype=object)):
+        registry.add(name)
+
+
+def _grown_from(known, current):
+    """True if a file with signature ``current`` is ``known`` plus appended bytes."""
+    if known is None:
+        return True
+    return current is not None and current[0] == known[0] and current[2] >= known[2]
+
+
+def _frame_from_rows(rows):
+    df = pd.DataFrame(rows, columns=["Id", "Date", "Category", "Cents"])
+    df["Date"] = pd.to_datetime(df["Date"], format="%Y-%m-%d")
+    df["Category"] = df["Category"].astype("category")
+    df.insert(2, "MonthKey", month_keys(df["Date"].to_numpy(dtype="datetime64[D]")))
+    df["Cents"] = df["Cents"].astype(np.int64)
+    df.insert(4, "Amount", from_cents(df["Cents"]))
+    return df
+
+
+def _format_row(values):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow(values)
+    return buffer.getvalue()
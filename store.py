@@ -0,0 +1,502 @@
+import datetime
+import functools
+import itertools
+import threading
+
+import numpy as np
+import pandas as pd
+
+import timing
+from categories import DEFAULT_CATEGORIES, CategoryRegistry
+
+
+def month_range(year, month):
+    """Return the ``[start, end)`` dates covering a calendar month."""
+    start = datetime.date(int(year), int(month), 1)
+    end = datetime.date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+
+def month_key(year, month):
+    """Return the integer key of a calendar month (months since 1970-01)."""
+    return (int(year) - 1970) * 12 + int(month) - 1
+
+
+def year_range(year):
+    """Return the ``[start, end)`` dates covering a calendar year."""
+    return datetime.date(int(year), 1, 1), datetime.date(int(year) + 1, 1, 1)
+
+
+def week_ranges(year, week):
+    """Return the ``[start, end)`` date ranges of ISO week ``week`` inside calendar ``year``.
+
+    ISO weeks cross year boundaries: early January can be in the last week
+    of the previous ISO year and late December in week 1 of the next, so a
+    week number can cover up to two stretches of one calendar year.
+    """
+    year_start, year_end = year_range(year)
+    ranges = []
+    for iso_year in (int(year) - 1, int(year), int(year) + 1):
+        try:
+            start = datetime.date.fromisocalendar(iso_year, int(week), 1)
+        except ValueError:  # the ISO year has no such week
+            continue
+        start, end = max(start, year_start), min(start + datetime.timedelta(days=7), year_end)
+        if start < end:
+            ranges.append((start, end))
+    return ranges
+
+
+def frame_span(frame, start, end):
+    """Return the ``(first, stop)`` positions of the rows of ``frame`` dated in ``[start, end)``.
+
+    ``frame`` is ``ExpenseStore.frame()`` or a slice of it, which are in
+    date order. The positions come from ``frame`` itself, so they stay valid
+    for it even if the store changes meanwhile.
+    """
+    first, stop = frame["Date"].searchsorted([pd.Timestamp(start), pd.Timestamp(end)])
+    return int(first), int(stop)
+
+
+def split_month_key(key):
+    """Return ``(year, month)`` for a month key; works element-wise on arrays."""
+    return key // 12 + 1970, key % 12 + 1
+
+
+def month_keys(dates):
+    """Vectorised ``month_key`` for an array of dates."""
+    return np.asarray(dates, dtype="datetime64[M]").astype(np.int32)
+
+
+def to_cents(amount):
+    """Return a dollar amount as integer cents; works element-wise on arrays."""
+    if np.ndim(amount) == 0:
+        return int(np.rint(float(amount) * 100))
+    return np.rint(np.asarray(amount, dtype=np.float64) * 100).astype(np.int64)
+
+
+def from_cents(cents):
+    """Return cents as a float dollar amount, for display; works element-wise on arrays."""
+    return cents / 100
+
+
+def format_cents(cents):
+    """Return cents as exact ``D.CC`` text; works element-wise on arrays."""
+    if np.ndim(cents) == 0:
+        cents = int(cents)
+        return f"{'-' if cents < 0 else ''}{abs(cents) // 100}.{abs(cents) % 100:02d}"
+    cents = pd.Series(np.asarray(cents, dtype=np.int64))
+    sign = (cents < 0).map({True: "-", False: ""})
+    whole, fraction = cents.abs() // 100, cents.abs() % 100
+    return (sign + whole.astype(str) + "." + fraction.astype(str).str.zfill(2)).to_numpy()
+
+
+def _locked(method):
+    """Run an ExpenseStore method holding the store's lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+# Versions are unique across every store in the process, so a version also
+# tells a reloaded store apart from the one it replaced.
+_versions = itertools.count(1)
+
+
+class ExpenseStore:
+    """Typed, columnar in-memory copy of the expense history.
+
+    Each expense is one slot across parallel NumPy columns: the storage row
+    id, the date as ``datetime64[D]``, its month as an ``int32`` key (see
+    ``month_key``), the category as an ``int8`` code from the store's
+    CategoryRegistry (``registry``) and
+    the amount as ``int64`` cents (see ``to_cents``). The columns grow by
+    doubling so appends are amortised O(1).
+
+    Rows are kept in date order (rows on the same day in the order they
+    were added), and so is ``frame()``: ``frame_span`` finds the rows of any
+    ``[start, end)`` period with two binary searches. Appending a row dated
+    on or after the last one is O(1); an earlier date, or an update that
+    changes a row's date, shifts the later rows along like a delete does.
+
+    Amounts stay in cents everywhere, totals included, so sums are exact;
+    they become dollars only for display (``from_cents``).
+
+    Month keys are derived once when rows are loaded or written, so month
+    filters are integer comparisons rather than per-row date formatting.
+    Likewise the frame's Category column is a Categorical over the registry
+    codes, so category filters and groupbys compare small integers.
+
+    ``frame()`` exposes the data as a pandas DataFrame that is built once
+    per change and shared by every screen, so callers must treat it as
+    read-only. Its ``Amount`` column is the dollar view of ``Cents``.
+
+    Running totals (overall, per year, month, category and month x category,
+    see ``_Totals``) are built on first use and then adjusted by every
+    append, update and delete, so the budget and View Expenses screens look
+    totals up instead of scanning the history.
+
+    One store is shared by every session of the process (through the
+    storage cache), so the methods that read several columns or change
+    them hold the store's lock; a frame or total never sees half a write.
+    """
+
+    _COLUMNS = ("_ids", "_dates", "_months", "_codes", "_cents")
+
+    def __init__(self, categories=DEFAULT_CATEGORIES):
+        self.registry = CategoryRegistry(categories)
+        self._lock = threading.RLock()
+
+        self._ids = np.empty(0, dtype=np.int64)
+        self._dates = np.empty(0, dtype="datetime64[D]")
+        self._months = np.empty(0, dtype=np.int32)
+        self._codes = np.empty(0, dtype=np.int8)
+        self._cents = np.empty(0, dtype=np.int64)
+        self._size = 0
+        # Row id handed to the next appended expense by the storage backend.
+        self.next_id = 0
+
+        # Changed on every change; used to know when frame() and cached
+        # charts are stale.
+        self.version = next(_versions)
+        # Changed when the row ids start naming other rows (renumber); ids
+        # from two stores with different id versions are not comparable.
+        self.id_version = self.version
+        self._frame = None
+        self._frame_version = -1
+        # _Totals, built lazily
+        self._running_totals = None
+
+    @classmethod
+    def from_columns(cls, ids, dates, categories, cents, known_categories=DEFAULT_CATEGORIES):
+        """Build a store from array-likes, e.g. the columns of a parsed CSV.
+
+        ``known_categories`` are registered first, so they keep the same
+        codes whatever the data holds.
+        """
+        registry = CategoryRegistry(known_categories)
+        categorical = pd.Categorical(categories)
+        codes = np.array([registry.code(registry.add(name)) for name in categorical.categories], dtype=np.int8)
+        return cls.from_codes(ids, dates, codes[categorical.codes], cents, registry.names())
+
+    @classmethod
+    def from_codes(cls, ids, dates, codes, cents, categories):
+        """Build a store from columns whose categories are codes into ``categories``.
+
+        Columns that already have the store's dtypes and are in date order
+        are used as they are, not copied, so they can be views of a
+        memory-mapped file (opened copy-on-write if the store will be
+        changed). Otherwise the rows are sorted by date, ties kept in order.
+        """
+        store = cls(categories)
+        store._ids = np.asarray(ids, dtype=np.int64)
+        store._dates = np.asarray(dates, dtype="datetime64[D]")
+        store._codes = np.asarray(codes, dtype=np.int8)
+        store._cents = np.asarray(cents, dtype=np.int64)
+        store._size = len(store._ids)
+        if store._size and (store._dates[1:] < store._dates[:-1]).any():
+            order = np.argsort(store._dates, kind="stable")
+            for name in ("_ids", "_dates", "_codes", "_cents"):
+                setattr(store, name, getattr(store, name)[order])
+        store._months = month_keys(store._dates)
+        store.next_id = int(store._ids.max()) + 1 if store._size else 0
+        return store
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+    @property
+    def dates(self):
+        return self._dates[:self._size]
+
+    @property
+    def months(self):
+        return self._months[:self._size]
+
+    @property
+    def codes(self):
+        return self._codes[:self._size]
+
+    @property
+    def cents(self):
+        return self._cents[:self._size]
+
+    @property
+    def categories(self):
+        """Every registered category name, in code order."""
+        return self.registry.names()
+
+    @_locked
+    def category_code(self, name):
+        """Return the code for ``name``, registering it if it is new."""
+        return self.registry.code(self.registry.add(name))
+
+    @_locked
+    def add_categories(self, names):
+        """Register the new names in ``names``; returns True if any were added."""
+        added = False
+        for name in names:
+            if name not in self.registry:
+                self.registry.add(name)
+                added = True
+        if added:
+            # The frame's Categorical lists every registered category
+            self.version = next(_versions)
+        return added
+
+    @_locked
+    def frame(self):
+        """Return the expenses as a DataFrame with Id, Date, MonthKey, Category, Amount and Cents."""
+        if self._frame_version != self.version:
+            version = self.version
+            with timing.timed("store.frame"):
+                self._frame = pd.DataFrame({
+                    "Id": self.ids,
+                    "Date": self.dates.astype("datetime64[s]"),
+                    "MonthKey": self.months,
+                    "Category": pd.Categorical.from_codes(self.codes, dtype=self.registry.dtype),
+                    "Amount": from_cents(self.cents),
+                    "Cents": self.cents,
+                })
+            self._frame_version = version
+        return self._frame
+
+    @_locked
+    def total(self, year=None, month=None, category=None):
+        """Return the cents spent, optionally in one year, month (1-12) and category.
+
+        A month without a year means that calendar month in every year. The
+        answer comes from the running totals, so the cost depends on the
+        number of years and categories, never on the number of expenses.
+        """
+        code = None
+        if category is not None:
+            code = self.registry.code(category)
+            if code is None:
+                return 0
+        totals = self._totals()
+        if month is None:
+            return totals.year_total(year, code)
+        years = [year] if year is not None else totals.years()
+        return sum(totals.month_total(month_key(y, month), code) for y in years)
+
+    @_locked
+    def month_category_total(self, key, category):
+        """Return the cents spent in month ``key`` on ``category``."""
+        code = self.registry.code(category)
+        if code is None:
+            return 0
+        return self._totals().month_total(key, code)
+
+    @_locked
+    def month_category_totals(self, key):
+        """Return ``{category: cents}`` for every category spent on in month ``key``."""
+        totals = self._totals()
+        return {
+            name: totals.by_month_category[(key, code)]
+            for code, name in enumerate(self.registry)
+            if (key, code) in totals.by_month_category
+        }
+
+    @_locked
+    def get(self, row_id):
+        """Return ``(date, category, cents)`` for ``row_id`` or None."""
+        pos = self._position(row_id)
+        if pos is None:
+            return None
+        return (
+            self._dates[pos].item(),
+            self.registry.name(self._codes[pos]),
+            int(self._cents[pos]),
+        )
+
+    @_locked
+    def append(self, row_id, date, category, cents):
+        pos = self._size
+        if pos and self._dates[pos - 1] > np.datetime64(date, "D"):
+            pos = int(np.searchsorted(self.dates, np.datetime64(date, "D"), side="right"))
+        self._open_slot(pos)
+        self._ids[pos] = row_id
+        self._set(pos, date, category, cents)
+        self._adjust_totals(pos, 1)
+        self.next_id = max(self.next_id, row_id + 1)
+        self.version = next(_versions)
+
+    @_locked
+    def extend(self, ids, dates, categories, cents):
+        """Add many rows at once; ``categories`` holds category names.
+
+        Rows dated on or after the last stored one are appended in place;
+        otherwise the batch is merged into date order in one pass.
+        """
+        count = len(ids)
+        if not count:
+            return
+        categorical = pd.Categorical(categories)
+        codes = np.array([self.category_code(name) for name in categorical.categories], dtype=np.int8)
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        order = np.argsort(dates, kind="stable")
+        new = {
+            "_ids": np.asarray(ids, dtype=np.int64)[order],
+            "_dates": dates[order],
+            "_months": month_keys(dates[order]),
+            "_codes": codes[categorical.codes][order],
+            "_cents": np.asarray(cents, dtype=np.int64)[order],
+        }
+
+        positions = np.searchsorted(self.dates, new["_dates"], side="right")
+        if positions[0] == self._size:
+            if self._size + count > len(self._ids):
+                self._grow(max(16, 2 * self._size, self._size + count))
+            for name in self._COLUMNS:
+                getattr(self, name)[self._size:self._size + count] = new[name]
+        else:
+            for name in self._COLUMNS:
+                setattr(self, name, np.insert(getattr(self, name)[:self._size], positions, new[name]))
+        if self._running_totals is not None:
+            self._running_totals.add_grouped(new["_months"], new["_codes"], new["_cents"])
+        self._size += count
+        self.next_id = max(self.next_id, int(new["_ids"].max()) + 1)
+        self.version = next(_versions)
+
+    @_locked
+    def update(self, row_id, date, category, cents):
+        pos = self._position(row_id)
+        if pos is None:
+            return False
+        self._adjust_totals(pos, -1)
+        self._set(pos, date, category, cents)
+        self._adjust_totals(pos, 1)
+        self._reposition(pos)
+        self.version = next(_versions)
+        return True
+
+    @_locked
+    def delete(self, row_id):
+        pos = self._position(row_id)
+        if pos is None:
+            return False
+        self._adjust_totals(pos, -1)
+        self._close_slot(pos)
+        self.version = next(_versions)
+        return True
+
+    @_locked
+    def renumber(self):
+        """Give rows the ids 0..n-1, matching a freshly compacted file.
+
+        Ids held from before no longer name the same rows; ``id_version``
+        changes so that holders can tell.
+        """
+        self._ids[:self._size] = np.arange(self._size)
+        self.next_id = self._size
+        self.version = next(_versions)
+        self.id_version = self.version
+
+    def _set(self, pos, date, category, cents):
+        self._dates[pos] = np.datetime64(date, "D")
+        self._months[pos] = self._dates[pos].astype("datetime64[M]").astype(np.int32)
+        self._codes[pos] = self.category_code(category)
+        self._cents[pos] = cents
+
+    def _open_slot(self, pos):
+        """Make room for one row at ``pos`` by shifting the rows from there on."""
+        if self._size == len(self._ids):
+            self._grow(max(16, 2 * self._size))
+        if pos < self._size:
+            for name in self._COLUMNS:
+                column = getattr(self, name)
+                column[pos + 1:self._size + 1] = column[pos:self._size]
+        self._size += 1
+
+    def _close_slot(self, pos):
+        for name in self._COLUMNS:
+            column = getattr(self, name)
+            column[pos:self._size - 1] = column[pos + 1:self._size]
+        self._size -= 1
+
+    def _reposition(self, pos):
+        """Move the row at ``pos`` to where its (changed) date belongs."""
+        date = self._dates[pos]
+        if (pos == 0 or self._dates[pos - 1] <= date) and (pos == self._size - 1 or date <= self._dates[pos + 1]):
+            return
+        row = [getattr(self, name)[pos] for name in self._COLUMNS]
+        self._close_slot(pos)
+        pos = int(np.searchsorted(self.dates, date, side="right"))
+        self._open_slot(pos)
+        for name, value in zip(self._COLUMNS, row):
+            getattr(self, name)[pos] = value
+
+    def _totals(self):
+        if self._running_totals is None:
+            self._running_totals = _Totals()
+            self._running_totals.add_grouped(self.months, self.codes, self.cents)
+        return self._running_totals
+
+    def _adjust_totals(self, pos, sign):
+        if self._running_totals is None:
+            return
+        self._running_totals.add(int(self._months[pos]), int(self._codes[pos]), sign * int(self._cents[pos]))
+
+    def _position(self, row_id):
+        matches = np.flatnonzero(self.ids == row_id)
+        return int(matches[0]) if len(matches) else None
+
+    def _grow(self, capacity):
+        for name in self._COLUMNS:
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            setattr(self, name, grown)
+
+
+class _Totals:
+    """Running totals of an ExpenseStore in cents, adjusted one expense at a time.
+
+    Totals are kept overall, per year, per category, per (year, category),
+    per month key and per (month key, category code).
+    """
+
+    def __init__(self):
+        self.overall = 0
+        self.by_year = {}
+        self.by_category = {}
+        self.by_year_category = {}
+        self.by_month = {}
+        self.by_month_category = {}
+
+    def add(self, key, code, cents):
+        year = key // 12 + 1970
+        self.overall += cents
+        self.by_year[year] = self.by_year.get(year, 0) + cents
+        self.by_category[code] = self.by_category.get(code, 0) + cents
+        self.by_year_category[(year, code)] = self.by_year_category.get((year, code), 0) + cents
+        self.by_month[key] = self.by_month.get(key, 0) + cents
+        self.by_month_category[(key, code)] = self.by_month_category.get((key, code), 0) + cents
+
+    def add_grouped(self, months, codes, cents):
+        """Add many expenses, summed per (month, category) first."""
+        grouped = pd.Series(cents).groupby([months, codes]).sum()
+        for (key, code), total in grouped.items():
+            self.add(int(key), int(code), int(total))
+
+    def years(self):
+        return list(self.by_year)
+
+    def year_total(self, year=None, code=None):
+        if year is None:
+            return self.overall if code is None else self.by_category.get(code, 0)
+        if code is None:
+            return self.by_year.get(year, 0)
+        return self.by_year_category.get((year, code), 0)
+
+    def month_total(self, key, code=None):
+        if code is None:
+            return self.by_month.get(key, 0)
+        return self.by_month_category.get((key, code), 0)
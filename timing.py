@@ -0,0 +1,171 @@
+import bisect
+import json
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Process-wide timings of the app's hot paths (loading, saving, each screen,
+# chart and PDF rendering), shared by every session and worker thread.
+# Each timer keeps a Prometheus-style cumulative histogram plus the last
+# WINDOW durations for percentiles, so the cost of recording is a lock and
+# a few integer updates.
+WINDOW = 500
+
+# Histogram bucket upper bounds, in seconds.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_timers = {}
+_timers_lock = threading.Lock()
+_server = None
+# Set when the server could not be started, so reruns don't retry the bind
+_server_error = None
+
+
+class _Timer:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # Per-bucket counts; the last slot is for durations above BUCKETS[-1]
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.recent = deque(maxlen=WINDOW)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.recent.append(seconds)
+
+
+def record(name, seconds):
+    with _timers_lock:
+        timer = _timers.get(name)
+        if timer is None:
+            timer = _timers[name] = _Timer()
+        timer.add(seconds)
+
+
+@contextmanager
+def timed(name):
+    """Record how long the ``with`` block takes under ``name``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def timed_function(name):
+    """Decorator form of ``timed``."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """Return ``{name: stats}`` with count, total, mean, p50, p95 and max seconds.
+
+    The percentiles cover the last WINDOW calls; the other figures every
+    call since the process started.
+    """
+    with _timers_lock:
+        timers = {name: (timer.count, timer.total, timer.max, sorted(timer.recent))
+                  for name, timer in _timers.items()}
+    stats = {}
+    for name, (count, total, longest, recent) in sorted(timers.items()):
+        stats[name] = {
+            "count": count,
+            "total": total,
+            "mean": total / count,
+            "p50": _percentile(recent, 0.5),
+            "p95": _percentile(recent, 0.95),
+            "max": longest,
+        }
+    return stats
+
+
+def to_json():
+    return json.dumps(snapshot(), indent=2)
+
+
+def to_prometheus():
+    """Return every timer as a Prometheus text-format histogram."""
+    with _timers_lock:
+        timers = {name: (timer.count, timer.total, list(timer.buckets)) for name, timer in _timers.items()}
+    metric = "expense_tracker_duration_seconds"
+    lines = [
+        f"# HELP {metric} Time spent in instrumented code paths.",
+        f"# TYPE {metric} histogram",
+    ]
+    for name, (count, total, buckets) in sorted(timers.items()):
+        label = name.replace("\\", "\\\\").replace('"', '\\"')
+        cumulative = 0
+        for bound, in_bucket in zip(BUCKETS, buckets):
+            cumulative += in_bucket
+            lines.append(f'{metric}_bucket{{name="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{name="{label}",le="+Inf"}} {count}')
+        lines.append(f'{metric}_sum{{name="{label}"}} {total}')
+        lines.append(f'{metric}_count{{name="{label}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _timers_lock:
+        _timers.clear()
+
+
+def serve(port, host="127.0.0.1"):
+    """Serve /metrics (Prometheus text) and /metrics.json on a daemon thread.
+
+    Only the first call in a process starts a server; later calls (e.g. from
+    every Streamlit rerun) return the running one. If the port cannot be
+    bound (e.g. it is already in use) the error is printed to stderr once and
+    None is returned, now and on later calls; the timings are still kept.
+    """
+    global _server, _server_error
+    with _timers_lock:
+        if _server is None and _server_error is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                _server_error = e
+                print(f"Metrics server not started on {host}:{port}: {e}", file=sys.stderr)
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        return _server
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = to_prometheus(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = to_json(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Scrapes would otherwise be logged to stderr on every request
+        pass
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]